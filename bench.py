@@ -0,0 +1,217 @@
+import importlib.util
+import os
+import sys
+import timeit
+
+
+def load(name, path):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_isspy():
+    return load('isspy', 'iss-py.py')
+
+
+def report(name, n, seconds):
+    print('  {:<24} {:>10.3f} ms'.format(name, 1000 * seconds / n))
+
+
+def bench_parse(isspy, args):
+    parsers = [('lxml + cssselect', isspy.HeavensAbove._parse),
+               ('stream', isspy.HeavensAbove._parse_stream)]
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        print('{} ({} bytes)'.format(path, len(text)))
+        reference = [p.to_dict() for p in parsers[0][1](text)]
+        for name, parse in parsers:
+            passes = [p.to_dict() for p in parse(text)]
+            if passes != reference:
+                print('  {:<24} MISMATCH'.format(name))
+                continue
+            report(name, args.n, timeit.timeit(lambda: parse(text), number=args.n))
+        print('  {} passes'.format(len(reference)))
+
+
+def bench_predict(isspy, args):
+    # Predicts from the TLE epoch: fixtures/iss.tle is too old for
+    # get_next_visibles, which refuses stale TLEs
+    from datetime import timedelta
+    with open(args.tle) as f:
+        tle = [l for l in f if l[:2] in ['1 ', '2 ']]
+    location = {'name': 'Tintagel Castle', 'lat': 50.6673, 'lng': -4.7585,
+                'alt': 39}
+    predictor = isspy.LocalPredictor(location, tle)
+    start = predictor.sgp4.epoch
+    for days in args.days:
+        end = start + timedelta(days=days)
+        passes = predictor.predict(start, end)
+        n = max(1, args.n // 20)
+        seconds = timeit.timeit(lambda: predictor.predict(start, end), number=n)
+        report('{} days, {} passes'.format(days, len(passes)), n, seconds)
+
+
+def bench_batch(isspy, args):
+    from datetime import timedelta
+    import random
+    with open(args.tle) as f:
+        tle = [l for l in f if l[:2] in ['1 ', '2 ']]
+    random.seed(0)
+    locations = [{'name': str(i),
+                  'lat': random.uniform(-60, 60),
+                  'lng': random.uniform(-180, 180),
+                  'alt': random.uniform(0, 2000)}
+                 for i in range(max(args.sites))]
+    predictor = isspy.LocalPredictor(locations[0], tle)
+    start = predictor.sgp4.epoch
+    end = start + timedelta(days=args.days)
+    seconds = timeit.timeit(lambda: predictor.predict(start, end), number=5)
+    report('1 site, sequential', 5, seconds)
+    for n in args.sites:
+        seconds = timeit.timeit(
+            lambda: predictor.predict_batch(locations[:n], start, end), number=1)
+        report('{} sites, batch'.format(n), 1, seconds)
+
+
+def bench_fetch(isspy, args):
+    import threading
+    server = load('server', os.path.join('fixtures', 'server.py')).serve(0, args.delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    isspy.HeavensAbove.Url = 'http://127.0.0.1:{}/PassSummary.aspx'.format(
+        server.server_address[1])
+    location = {'name': 'Tintagel Castle', 'lat': 50.6673, 'lng': -4.7585,
+                'alt': 39}
+    print('{} s of latency per request'.format(args.delay))
+    provider = isspy.HeavensAbove(location)
+    passes = provider.get_next_visibles()
+    report('{} passes'.format(len(passes)), 1, provider.timing['request'])
+    provider.get_next_visibles()
+    report('revalidated', 1, provider.timing['request'])
+    server.shutdown()
+
+
+def bench_show(isspy, args):
+    import struct
+    import tempfile
+    import numpy as np
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(bytes(128))
+        f.flush()
+        frame = np.random.default_rng(0).integers(0, 256, (8, 8, 3), dtype=np.uint8)
+
+        # What sense_hat.SenseHat.set_pixels does for each frame
+        layout = np.rot90(np.arange(64).reshape(8, 8), 2).tolist()
+        def set_pixels(pixels):
+            with open(f.name, 'r+b') as fb:
+                for index, pix in enumerate(pixels):
+                    if len(pix) != 3:
+                        raise ValueError()
+                    for element in pix:
+                        if element > 255 or element < 0:
+                            raise ValueError()
+                    r = (pix[0] >> 3) & 0x1F
+                    g = (pix[1] >> 2) & 0x3F
+                    b = (pix[2] >> 3) & 0x1F
+                    fb.seek(layout[index // 8][index % 8] * 2)
+                    fb.write(struct.pack('H', (r << 11) + (g << 5) + b))
+        seconds = timeit.timeit(
+            lambda: set_pixels(frame.reshape(64, 3).tolist()), number=args.n)
+        report('sense_hat set_pixels', args.n, seconds)
+
+        backend = isspy.FramebufferBackend(f.name)
+        seconds = timeit.timeit(lambda: backend.set_pixels(frame), number=args.n)
+        report('mmap framebuffer', args.n, seconds)
+
+
+def bench_frames(isspy, args):
+    import asyncio
+    import logging
+    import time
+    from datetime import datetime, timedelta
+    # Frames statistics of each phase are logged at debug level
+    isspy.logger.setLevel(logging.DEBUG)
+    isspy.ch.setLevel(logging.DEBUG)
+    isspy.S.init()
+    T = isspy.T
+    T.SplashDuration = timedelta(seconds=args.seconds)
+    T.CountdownDuration = timedelta(seconds=args.seconds)
+    T.SetupDuration = timedelta(0)
+
+    def make_pass(delay):
+        p = isspy.Pass()
+        p.StartTime = datetime.utcnow() + delay
+        p.StartAltitude = 10
+        p.StartAzimuth = 290
+        p.HighTime = p.StartTime + timedelta(seconds=args.seconds / 2)
+        p.HighAltitude = 55
+        p.HighAzimuth = 220
+        p.EndTime = p.StartTime + timedelta(seconds=args.seconds)
+        p.EndAltitude = 20
+        p.EndAzimuth = 170
+        return p
+
+    phases = [('splash_screen', isspy.splash_screen),
+              ('countdown', lambda d: isspy.countdown(
+                  d, isspy.Timeline(make_pass(T.CountdownDuration)))),
+              ('monitor', lambda d: isspy.monitor(
+                  d, isspy.Timeline(make_pass(timedelta(0)))))]
+    if args.record:
+        print('Frames saved to {}-<phase>.png'.format(args.record))
+    for name, phase in phases:
+        backend = isspy.RecordingBackend()
+        display = isspy.Display(backend)
+        t0 = time.monotonic()
+        asyncio.run(phase(display))
+        elapsed = time.monotonic() - t0
+        rendered = display.frames_sent + display.frames_skipped
+        print('  {:<16} {:>6.1f} frames/s rendered, {:>6.1f} written'.format(
+            name, rendered / elapsed, display.frames_sent / elapsed))
+        if args.record:
+            backend.dump_png('{}-{}.png'.format(args.record, name))
+
+
+def main(arguments):
+    import argparse
+    import glob
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+    parser = argparse.ArgumentParser('IssPy - benchmarks')
+    parser.add_argument('-n', type=int, dest='n', default=200)
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('parse', help='PassSummary parsers')
+    command.add_argument('files', nargs='*',
+                         default=sorted(glob.glob(os.path.join(fixtures, 'PassSummary*.html'))))
+    command.set_defaults(bench=bench_parse)
+    command = commands.add_parser('predict', help='local SGP4 pass prediction')
+    command.add_argument('--tle', dest='tle',
+                         default=os.path.join(fixtures, 'iss.tle'))
+    command.add_argument('days', nargs='*', type=int, default=[1, 10, 30])
+    command.set_defaults(bench=bench_predict)
+    command = commands.add_parser('batch', help='batch prediction for many sites')
+    command.add_argument('--tle', dest='tle',
+                         default=os.path.join(fixtures, 'iss.tle'))
+    command.add_argument('--days', type=int, dest='days', default=10)
+    command.add_argument('sites', nargs='*', type=int, default=[10, 100, 1000])
+    command.set_defaults(bench=bench_batch)
+    command = commands.add_parser('fetch', help='Heavens Above pages, on the fixture server')
+    command.add_argument('--delay', type=float, dest='delay', default=0.2)
+    command.set_defaults(bench=bench_fetch)
+    command = commands.add_parser('frames', help='animation frame rates, headless')
+    command.add_argument('--seconds', type=float, dest='seconds', default=3)
+    command.add_argument('--record', dest='record',
+                         help='save the frames of each phase as PNG strips')
+    command.set_defaults(bench=bench_frames)
+    command = commands.add_parser('show', help='frame writes to a file-backed framebuffer')
+    command.set_defaults(bench=bench_show)
+    args = parser.parse_args(arguments[1:])
+    if args.command is None:
+        parser.print_help()
+        return
+    args.bench(load_isspy(), args)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
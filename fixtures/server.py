@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import http.server
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+
+
+# Local stand-in for heavens-above.com, to test and benchmark HeavensAbove
+# without the real site:
+#     python3 fixtures/server.py --port 8000 --delay 0.5
+#     python3 iss-py.py --url http://localhost:8000/PassSummary.aspx
+# PassSummary.aspx answers 10 days of made-up passes from today, inside the
+# saved PassSummary.html page. Passes are derived from their start time
+# only, so that the page is the same all day. ETag, 304 and gzip are
+# supported.
+
+Template = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'PassSummary.html')
+Compass = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+           'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
+Orbit = timedelta(minutes=92.7)
+Epoch = datetime(1858, 11, 17)
+
+
+def make_row(satid, start):
+    r = random.Random('{}:{}'.format(satid, start.isoformat()))
+    high = start + timedelta(seconds=r.randint(60, 330))
+    end = high + timedelta(seconds=r.randint(60, 330))
+    az = r.randrange(16)
+    cells = [start.strftime('%d %b'),
+             '{:.1f}'.format(r.uniform(-3.9, -0.4)),
+             start.strftime('%H:%M:%S'), '10°', Compass[az],
+             high.strftime('%H:%M:%S'), '{}°'.format(r.randint(11, 88)),
+             Compass[(az + r.randint(2, 5)) % 16],
+             end.strftime('%H:%M:%S'), '{}°'.format(r.randint(10, 40)),
+             Compass[(az + r.randint(6, 9)) % 16],
+             'visible']
+    cells[0] = '<a href="passdetails.aspx?satid={}">{}</a>'.format(satid, cells[0])
+    return ('<tr class="clickableRow">\n' +
+            ''.join('<td align="center">{}</td>\n'.format(c) for c in cells) +
+            '</tr>')
+
+
+def make_page(template, satid, start):
+    # About one orbit in four is a visible pass
+    n = int((start - Epoch) / Orbit) + 1
+    rows = []
+    t = Epoch + n * Orbit
+    while t < start + timedelta(days=10):
+        if random.Random('{}:{}'.format(satid, n)).random() < 0.25:
+            rows.append(make_row(satid, t.replace(microsecond=0)))
+        n = n + 1
+        t = Epoch + n * Orbit
+    head, rest = template.split('<tbody>', 1)
+    tail = rest.split('</tbody>', 1)[1]
+    return head + '<tbody>\n' + '\n'.join(rows) + '\n</tbody>' + tail
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    template = None
+    delay = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/PassSummary.aspx':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        satid = query.get('satid', ['25544'])[0]
+        start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        body = make_page(Handler.template, satid, start).encode('utf-8')
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+
+        time.sleep(Handler.delay)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, delay=0):
+    with open(Template, encoding='utf-8') as f:
+        Handler.template = f.read()
+    Handler.delay = delay
+    return http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+
+def main(arguments):
+    import argparse
+    parser = argparse.ArgumentParser('IssPy - Heavens Above fixture server')
+    parser.add_argument('--port', type=int, dest='port', default=8000)
+    parser.add_argument('--delay', type=float, dest='delay', default=0,
+                        help='seconds of latency added to each request')
+    args = parser.parse_args(arguments[1:])
+    server = serve(args.port, args.delay)
+    print('Serving on http://127.0.0.1:{}/PassSummary.aspx'.format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,11 +1,28 @@
-import requests
-import lxml.html as html
+from html import unescape
+import re
 import time
-from datetime import date, datetime, timedelta
-from sense_hat import SenseHat
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import math
+import numpy as np
 import logging
 import sys
+import os
+import json
+import mmap
+import socket
+import struct
+import zlib
+import threading
+import bisect
+import heapq
+import signal
+import hashlib
+import functools
+from array import array
+import asyncio
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Logging facility
@@ -30,6 +47,51 @@ def debug(*args):
     logger.debug(' '.join([t] + [str(i) for i in args]))
 
 
+class Startup:
+    # Time of each startup phase since the process started, for
+    # --startup-profile. The network and HTML stacks are only imported by
+    # the first fetch, so that they do not delay the splash screen.
+    enabled = False
+    phases = []
+
+    @staticmethod
+    def process_start():
+        # On the monotonic clock, from /proc where available so that the
+        # interpreter startup is included
+        try:
+            with open('/proc/self/stat') as f:
+                ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+            age = (time.clock_gettime(time.CLOCK_BOOTTIME) -
+                   ticks / os.sysconf('SC_CLK_TCK'))
+            return time.monotonic() - age
+        except (OSError, ValueError, IndexError, AttributeError):
+            return time.monotonic()
+
+    @staticmethod
+    def mark(name):
+        Startup.phases.append((name, time.monotonic()))
+
+    @staticmethod
+    def elapsed():
+        return time.monotonic() - Startup.start
+
+    @staticmethod
+    def report():
+        if not Startup.enabled:
+            return
+        lines = ['Startup profile:']
+        t0 = Startup.start
+        for name, t in sorted(Startup.phases, key=lambda p: p[1]):
+            lines.append('  {:<12} {:>8.0f} ms {:>8.0f} ms'.format(
+                name, 1000 * (t - t0), 1000 * (t - Startup.start)))
+            t0 = t
+        info('\n'.join(lines))
+
+
+Startup.start = Startup.process_start()
+Startup.mark('imports')
+
+
 class Azimuth:
     Names = {
         'N': 0, 'NNE': 22.5, 'NE': 45, 'ENE': 67.5,
@@ -60,7 +122,13 @@ class Azimuth:
 
 
 class Pass:
+    Fields = ['SatId', 'Date', 'Magnitude',
+              'StartTime', 'StartAltitude', 'StartAzimuth',
+              'HighTime', 'HighAltitude', 'HighAzimuth',
+              'EndTime', 'EndAltitude', 'EndAzimuth']
+
     def __init__(self):
+        self.SatId = None
         self.Date = None
         self.Magnitude = None
         self.StartTime = None
@@ -74,7 +142,8 @@ class Pass:
         self.EndAzimuth = None
 
     def __str__(self):
-        return '{} | {} | {}° {} @ {} | {}° {} @ {} | {}° {} @ {}'.format(
+        return '{} | {} | {} | {}° {} @ {} | {}° {} @ {} | {}° {} @ {}'.format(
+            self.SatId,
             self.Date,
             self.Magnitude,
             self.StartAltitude,
@@ -87,29 +156,369 @@ class Pass:
             Azimuth.to_string(self.EndAzimuth),
             self.EndTime.strftime("%H:%M:%S"))
 
+    def to_dict(self):
+        d = {}
+        for key in Pass.Fields:
+            value = getattr(self, key)
+            if isinstance(value, date):
+                value = value.isoformat()
+            d[key] = value
+        return d
+
+    @staticmethod
+    def from_dict(d):
+        p = Pass()
+        for key in Pass.Fields:
+            setattr(p, key, d.get(key))
+        p.Date = date.fromisoformat(p.Date)
+        p.StartTime = datetime.fromisoformat(p.StartTime)
+        p.HighTime = datetime.fromisoformat(p.HighTime)
+        p.EndTime = datetime.fromisoformat(p.EndTime)
+        return p
+
+
+class PassTable:
+    # Passes stored column-wise in typed arrays, sorted by start time: times
+    # as epoch seconds, angles and magnitude as float32. Rows are read
+    # through PassView, and time queries are binary searches.
+    Epoch = datetime(1970, 1, 1)
+    Times = ['StartTime', 'HighTime', 'EndTime']
+    Floats = ['Magnitude',
+              'StartAltitude', 'StartAzimuth',
+              'HighAltitude', 'HighAzimuth',
+              'EndAltitude', 'EndAzimuth']
+    # Decimals of the sources, float32 values are read back rounded to them
+    Decimals = 3
+
+    def __init__(self, passes=()):
+        self.satids = array('l')
+        self.columns = {}
+        for key in PassTable.Times:
+            self.columns[key] = array('d')
+        for key in PassTable.Floats:
+            self.columns[key] = array('f')
+        # Running maximum of the end times, which is sorted even when
+        # passes of different satellites overlap
+        self.reach = array('d')
+        self.indexes = {}
+        for p in sorted(passes, key=lambda p: p.StartTime):
+            self.append(p)
+
+    def __len__(self):
+        return len(self.satids)
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return PassView(self, i % len(self))
+
+    def __iter__(self):
+        return (PassView(self, i) for i in range(len(self)))
+
+    def append(self, p):
+        start = PassTable.seconds(p.StartTime)
+        if len(self) > 0 and start < self.columns['StartTime'][-1]:
+            raise ValueError('Passes must be appended in time order')
+        self.satids.append(p.SatId or 0)
+        for key in PassTable.Times:
+            self.columns[key].append(PassTable.seconds(getattr(p, key)))
+        for key in PassTable.Floats:
+            value = getattr(p, key)
+            self.columns[key].append(float('nan') if value is None else value)
+        end = self.columns['EndTime'][-1]
+        self.reach.append(max(end, self.reach[-1]) if self.reach else end)
+        self.indexes.clear()
+
+    def next_after(self, t):
+        # First pass not over at t
+        i = bisect.bisect_right(self.reach, PassTable.seconds(t))
+        return self[i] if i < len(self) else None
+
+    def in_window(self, t0, t1):
+        # Passes overlapping [t0, t1)
+        s0 = PassTable.seconds(t0)
+        i = bisect.bisect_right(self.reach, s0)
+        j = bisect.bisect_left(self.columns['StartTime'], PassTable.seconds(t1))
+        end = self.columns['EndTime']
+        return [PassView(self, k) for k in range(i, j) if end[k] > s0]
+
+    def upcoming(self, t):
+        i = bisect.bisect_right(self.reach, PassTable.seconds(t))
+        end = self.columns['EndTime']
+        s = PassTable.seconds(t)
+        return [PassView(self, k) for k in range(i, len(self)) if end[k] > s]
+
+    @staticmethod
+    def seconds(t):
+        return (t - PassTable.Epoch).total_seconds()
+
+    @staticmethod
+    def datetime(s):
+        return PassTable.Epoch + timedelta(seconds=s)
+
+
+class PassView:
+    # Read-only row of a PassTable, usable wherever a Pass is expected
+    __slots__ = ['table', 'index']
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def SatId(self):
+        return self.table.satids[self.index] or None
+
+    @property
+    def Date(self):
+        return self.StartTime.date()
+
+    def __eq__(self, other):
+        return (isinstance(other, PassView) and
+                self.table is other.table and self.index == other.index)
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+    __str__ = Pass.__str__
+    to_dict = Pass.to_dict
+
+
+def _time_column(key):
+    return property(lambda self: PassTable.datetime(
+        self.table.columns[key][self.index]))
+
+
+def _float_column(key):
+    # float32 storage, rounded back to the precision of the sources
+    return property(lambda self: round(self.table.columns[key][self.index],
+                                       PassTable.Decimals))
+
+
+for key in PassTable.Times:
+    setattr(PassView, key, _time_column(key))
+for key in PassTable.Floats:
+    setattr(PassView, key, _float_column(key))
+
+
+class PassIndex:
+    # Rows of a PassTable sorted by the values of one column
+    def __init__(self, values):
+        self.rows = sorted(range(len(values)), key=values.__getitem__)
+        self.values = [values[i] for i in self.rows]
+
+    def range(self, lo, hi):
+        # Rows with lo <= value <= hi, or the wrap-around complement when
+        # lo > hi (e.g. azimuths from NW to NE, times from 22:00 to 02:00)
+        if lo > hi:
+            return (self.rows[bisect.bisect_left(self.values, lo):] +
+                    self.rows[:bisect.bisect_right(self.values, hi)])
+        return self.rows[bisect.bisect_left(self.values, lo):
+                         bisect.bisect_right(self.values, hi)]
+
+    def compare(self, op, x):
+        if op == '<':
+            return self.rows[:bisect.bisect_left(self.values, x)]
+        if op == '<=':
+            return self.rows[:bisect.bisect_right(self.values, x)]
+        if op == '>':
+            return self.rows[bisect.bisect_right(self.values, x):]
+        if op == '>=':
+            return self.rows[bisect.bisect_left(self.values, x):]
+        return self.range(x, x)
+
+
+class PassFilter:
+    # Selects the passes of a PassTable matching all of a list of
+    # conditions, as written in config.json:
+    #     "HighAltitude >= 30", "Magnitude <= -2",
+    #     "HighAzimuth in SW..W", "Time in 18:00..23:30"
+    # where Time is the local start time of the pass. Each condition is
+    # answered from a sorted index of its column, built once per table.
+    Operators = ['<', '<=', '>', '>=', '==', 'in']
+
+    def __init__(self, conditions, tz='UTC'):
+        self.conditions = [PassFilter._parse(c) for c in conditions]
+        self.text = list(conditions)
+        try:
+            self.tz = ZoneInfo(tz)
+        except (ValueError, ZoneInfoNotFoundError):
+            info('Unknown time zone "{}", using UTC'.format(tz))
+            self.tz = timezone.utc
+
+    def __str__(self):
+        return ', '.join(self.text) or 'all passes'
+
+    def select(self, table):
+        rows = None
+        for field, op, value in self.conditions:
+            index = self._index(table, field)
+            if op == 'in':
+                matches = index.range(*value)
+            else:
+                matches = index.compare(op, value)
+            rows = set(matches) if rows is None else rows.intersection(matches)
+        if rows is None:
+            return list(range(len(table)))
+        return sorted(rows)
+
+    def apply(self, table):
+        return PassTable(table[i] for i in self.select(table))
+
+    def _index(self, table, field):
+        key = (field, self.tz) if field == 'Time' else field
+        index = table.indexes.get(key)
+        if index is None:
+            if field == 'Time':
+                values = [PassFilter._time_of_day(
+                    PassTable.datetime(t).replace(tzinfo=timezone.utc)
+                    .astimezone(self.tz).time())
+                    for t in table.columns['StartTime']]
+            else:
+                # Compared as PassView reads them, the float32 values are
+                # off from the thresholds written in the filters
+                values = [round(v, PassTable.Decimals)
+                          for v in table.columns[field]]
+            index = table.indexes[key] = PassIndex(values)
+        return index
+
+    @staticmethod
+    def _parse(condition):
+        try:
+            field, op, value = condition.split(None, 2)
+        except ValueError:
+            raise ValueError('Invalid filter "{}"'.format(condition))
+        if field != 'Time' and field not in PassTable.Floats:
+            raise ValueError('Unknown field in filter "{}"'.format(condition))
+        if op not in PassFilter.Operators:
+            raise ValueError('Unknown operator in filter "{}"'.format(condition))
+        if op == 'in':
+            value = tuple(PassFilter._value(field, v) for v in value.split('..'))
+            if len(value) != 2:
+                raise ValueError('Invalid range in filter "{}"'.format(condition))
+        else:
+            value = PassFilter._value(field, value)
+        return field, op, value
+
+    @staticmethod
+    def _value(field, text):
+        text = text.strip()
+        if field == 'Time':
+            return PassFilter._time_of_day(datetime.strptime(text, '%H:%M').time())
+        if field.endswith('Azimuth') and Azimuth.from_string(text) is not None:
+            return Azimuth.from_string(text)
+        return float(text)
+
+    @staticmethod
+    def _time_of_day(t):
+        return 3600 * t.hour + 60 * t.minute + t.second
+
 
 class HeavensAbove:
-    def __init__(self, loc):
+    Url = 'http://www.heavens-above.com/PassSummary.aspx'
+    Months = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+              'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+    Row = re.compile(r'<tr[^>]*class="[^"]*clickableRow[^>]*>(.*?)</tr>', re.S)
+    Cell = re.compile(r'<td[^>]*>(.*?)</td>', re.S)
+    Tag = re.compile(r'<[^>]*>')
+
+    def __init__(self, loc, satid=25544, parser='stream'):
         self.location = loc
+        self.satid = satid
+        self.parse = {'stream': HeavensAbove._parse_stream,
+                      'lxml': HeavensAbove._parse}[parser]
+        self.session = None
+        self.etag = None
+        self.last_modified = None
+        self.passes = []
+        self.timing = {}
 
     def name(self):
         return "Heavens Above (www.heavens-above.com)"
-    
+
+    def key(self):
+        params = HeavensAbove._from_location(self.location, self.satid)
+        return 'heavens-above:{satid}:{lat:.4f}:{lng:.4f}:{alt}'.format(**params)
+
     def get_next_visibles(self):
-        passes = []
-        r = requests.get('http://www.heavens-above.com/PassSummary.aspx',
-                         params=HeavensAbove._from_location(self.location))
-        d = html.fromstring(r.text)
+        if self.session is None:
+            self.session = self._open_session()
+        start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+
+        t0 = time.monotonic()
+        r = self.session.get(HeavensAbove.Url,
+                             params=HeavensAbove._from_location(self.location,
+                                                                self.satid),
+                             headers=headers,
+                             timeout=T.OnlineTimeout)
+        t1 = time.monotonic()
+        if r.status_code != 304:
+            r.raise_for_status()
+            self.etag = r.headers.get('ETag')
+            self.last_modified = r.headers.get('Last-Modified')
+            self.passes = self.parse(r.text)
+            for p in self.passes:
+                p.SatId = self.satid
+                # Rows only have a day and month: passes early next year
+                # were parsed in the current year
+                if p.StartTime < start - timedelta(days=180):
+                    HeavensAbove._next_year(p)
+        t2 = time.monotonic()
+
+        self.timing = {'status': r.status_code,
+                       'bytes': len(r.content),
+                       'request': t1 - t0,
+                       'parse': t2 - t1}
+        debug('Fetched {status} ({bytes} bytes) in {request:.3f}s, '
+              'parsed in {parse:.3f}s'.format(**self.timing))
+
         now = datetime.utcnow()
-        for row in d.cssselect('.standardTable .clickableRow'):
-            p = HeavensAbove._make_pass(row.cssselect('td'))
-            if p.EndTime > now:
-                passes.append(p)
+        return [p for p in self.passes if p.EndTime > now]
+
+    def _open_session(self):
+        import requests
+        session = requests.Session()
+        session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                'Connection': 'keep-alive'})
+        return session
+
+    @staticmethod
+    def _next_year(p):
+        p.Date = p.Date.replace(year=p.Date.year + 1)
+        p.StartTime = p.StartTime.replace(year=p.StartTime.year + 1)
+        p.HighTime = p.HighTime.replace(year=p.HighTime.year + 1)
+        p.EndTime = p.EndTime.replace(year=p.EndTime.year + 1)
+
+    @staticmethod
+    def _parse(text):
+        import lxml.html
+        d = lxml.html.fromstring(text)
+        return [HeavensAbove._make_pass(row.cssselect('td'))
+                for row in d.cssselect('.standardTable .clickableRow')]
+
+    @staticmethod
+    def _parse_stream(text):
+        # Only tokenizes the clickableRow rows of the pass table instead of
+        # building the whole DOM, and avoids strptime
+        start = text.find('standardTable')
+        if start < 0:
+            return []
+        year = date.today().year
+        passes = []
+        for row in HeavensAbove.Row.finditer(text, start):
+            cells = [unescape(HeavensAbove.Tag.sub('', c)).strip()
+                     for c in HeavensAbove.Cell.findall(row.group(1))]
+            passes.append(HeavensAbove._make_pass_fast(cells, year))
         return passes
 
     @staticmethod
-    def _from_location(loc):
-        return {'satid': 25544,
+    def _from_location(loc, satid):
+        return {'satid': satid,
                 'lat': loc['lat'],
                 'lng': loc['lng'],
                 'loc': loc['name'],
@@ -139,6 +548,30 @@ class HeavensAbove:
         p.EndAzimuth = Azimuth.from_string(cells[10].text)
         return p
 
+    @staticmethod
+    def _make_pass_fast(cells, year):
+        day, month = cells[0].split()
+        pass_date = date(year, HeavensAbove.Months[month], int(day))
+
+        p = Pass()
+        p.Date = pass_date
+        p.Magnitude = float(cells[1])
+        p.StartTime = HeavensAbove._make_time(pass_date, cells[2])
+        p.StartAltitude = float(cells[3].split('°')[0])
+        p.StartAzimuth = Azimuth.from_string(cells[4])
+        p.HighTime = HeavensAbove._make_time(pass_date, cells[5])
+        p.HighAltitude = float(cells[6].split('°')[0])
+        p.HighAzimuth = Azimuth.from_string(cells[7])
+        p.EndTime = HeavensAbove._make_time(pass_date, cells[8])
+        p.EndAltitude = float(cells[9].split('°')[0])
+        p.EndAzimuth = Azimuth.from_string(cells[10])
+        return p
+
+    @staticmethod
+    def _make_time(d, hms):
+        return datetime(d.year, d.month, d.day,
+                        int(hms[0:2]), int(hms[3:5]), int(hms[6:8]))
+
 
 class TestProvider:
     def name(self):
@@ -147,6 +580,7 @@ class TestProvider:
     def get_next_visibles(self):
         now = datetime.utcnow()
         p = Pass()
+        p.SatId = 25544
         p.Date = date.today()
         p.Magnitude = -2.6
         p.StartTime = now + timedelta(minutes=2.1)
@@ -168,7 +602,646 @@ class NoneProvider:
     def get_next_visibles(self):
         return []
 
-    
+
+class PassServerProvider:
+    # Passes pushed by a pass server (iss-py.py --serve) for this location,
+    # received on a background connection that reconnects when lost.
+    # on_update, when set, is called from that thread on each push.
+    def __init__(self, address, loc, satids=(25544,)):
+        self.address = address
+        self.location = loc
+        self.satids = tuple(satids)
+        self.passes = {}
+        self.lock = threading.Lock()
+        self.received = threading.Event()
+        self.on_update = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def name(self):
+        return 'Pass server ({})'.format(self.address)
+
+    def key(self):
+        return 'pass-server:{}:{}:{:.4f}:{:.4f}'.format(
+            self.address, '+'.join(str(s) for s in self.satids),
+            self.location['lat'], self.location['lng'])
+
+    def get_next_visibles(self):
+        # Waits for the first push only: a satellite the server fails to
+        # fetch must not hold back the others, they arrive with on_update
+        if not self.received.wait(T.OnlineTimeout):
+            raise IOError('No passes from "{}" yet'.format(self.address))
+        now = datetime.utcnow()
+        with self.lock:
+            passes = [p for l in self.passes.values() for p in l
+                      if p.EndTime > now]
+        return sorted(passes, key=lambda p: p.StartTime)
+
+    def _run(self):
+        delay = 1
+        while True:
+            try:
+                with PassServer.connect(self.address) as sock:
+                    request = {'subscribe': {'lat': self.location['lat'],
+                                             'lng': self.location['lng'],
+                                             'satids': list(self.satids)}}
+                    sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+                    delay = 1
+                    for line in sock.makefile('r', encoding='utf-8'):
+                        self._receive(json.loads(line))
+                info('Pass server "{}" closed the connection'.format(self.address))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                info('Pass server "{}" failed:'.format(self.address), e)
+            time.sleep(delay)
+            delay = min(2 * delay, 60)
+
+    def _receive(self, message):
+        passes = [Pass.from_dict(p) for p in message['passes']]
+        with self.lock:
+            self.passes[message['satid']] = passes
+        self.received.set()
+        debug('Pass server pushed', len(passes), 'passes for',
+              message['satid'], 'in', message['bucket'])
+        if self.on_update is not None:
+            self.on_update()
+
+
+class SGP4:
+    # Near-earth SGP4 propagator (Vallado et al., "Revisiting Spacetrack
+    # Report #3", WGS72 constants), vectorized over time with NumPy.
+    # Deep-space (period >= 225 min) orbits are not supported.
+    Radius = 6378.135
+    XKE = 60.0 / math.sqrt(6378.135 ** 3 / 398600.8)
+    J2 = 0.001082616
+    J3 = -0.00000253881
+    J4 = -0.00000165597
+
+    def __init__(self, line1, line2):
+        self.satnum = int(line1[2:7])
+        year = int(line1[18:20])
+        year = year + (2000 if year < 57 else 1900)
+        self.epoch = (datetime(year, 1, 1) +
+                      timedelta(days=float(line1[20:32]) - 1))
+        self.bstar = SGP4._exp_float(line1[53:61])
+        self.inclo = math.radians(float(line2[8:16]))
+        self.nodeo = math.radians(float(line2[17:25]))
+        self.ecco = float('0.' + line2[26:33].strip())
+        self.argpo = math.radians(float(line2[34:42]))
+        self.mo = math.radians(float(line2[43:51]))
+        self.no_kozai = float(line2[52:63]) * 2 * math.pi / 1440
+        if 2 * math.pi / self.no_kozai >= 225:
+            raise ValueError('Deep-space orbits are not supported')
+        self._init()
+
+    @staticmethod
+    def _exp_float(s):
+        s = s.strip()
+        sign = -1 if s[0] == '-' else 1
+        s = s.lstrip('+-')
+        mantissa, exponent = s[:-2], s[-2:]
+        return sign * float('0.' + mantissa.strip()) * 10 ** int(exponent)
+
+    def _init(self):
+        j2, j3, j4, xke = SGP4.J2, SGP4.J3, SGP4.J4, SGP4.XKE
+        j3oj2 = j3 / j2
+        x2o3 = 2 / 3
+        ecco, inclo, bstar = self.ecco, self.inclo, self.bstar
+
+        eccsq = ecco * ecco
+        omeosq = 1 - eccsq
+        rteosq = math.sqrt(omeosq)
+        cosio = math.cos(inclo)
+        cosio2 = cosio * cosio
+        ak = (xke / self.no_kozai) ** x2o3
+        d1 = 0.75 * j2 * (3 * cosio2 - 1) / (rteosq * omeosq)
+        delta = d1 / (ak * ak)
+        adel = ak * (1 - delta * delta -
+                     delta * (1 / 3 + 134 * delta * delta / 81))
+        delta = d1 / (adel * adel)
+        no = self.no_kozai / (1 + delta)
+        ao = (xke / no) ** x2o3
+        sinio = math.sin(inclo)
+        po = ao * omeosq
+        con42 = 1 - 5 * cosio2
+        con41 = -con42 - cosio2 - cosio2
+        posq = po * po
+        rp = ao * (1 - ecco)
+
+        ss = 78 / SGP4.Radius + 1
+        qzms2t = ((120 - 78) / SGP4.Radius) ** 4
+        self.isimp = rp < 220 / SGP4.Radius + 1
+        sfour = ss
+        qzms24 = qzms2t
+        perige = (rp - 1) * SGP4.Radius
+        if perige < 156:
+            sfour = perige - 78
+            if perige < 98:
+                sfour = 20
+            qzms24 = ((120 - sfour) / SGP4.Radius) ** 4
+            sfour = sfour / SGP4.Radius + 1
+        pinvsq = 1 / posq
+        tsi = 1 / (ao - sfour)
+        eta = ao * ecco * tsi
+        etasq = eta * eta
+        eeta = ecco * eta
+        psisq = abs(1 - etasq)
+        coef = qzms24 * tsi ** 4
+        coef1 = coef / psisq ** 3.5
+        cc2 = coef1 * no * (ao * (1 + 1.5 * etasq + eeta * (4 + etasq)) +
+                            0.375 * j2 * tsi / psisq * con41 *
+                            (8 + 3 * etasq * (8 + etasq)))
+        cc1 = bstar * cc2
+        cc3 = 0
+        if ecco > 1e-4:
+            cc3 = -2 * coef * tsi * j3oj2 * no * sinio / ecco
+        x1mth2 = 1 - cosio2
+        cc4 = 2 * no * coef1 * ao * omeosq * (
+            eta * (2 + 0.5 * etasq) + ecco * (0.5 + 2 * etasq) -
+            j2 * tsi / (ao * psisq) * (
+                -3 * con41 * (1 - 2 * eeta + etasq * (1.5 - 0.5 * eeta)) +
+                0.75 * x1mth2 * (2 * etasq - eeta * (1 + etasq)) *
+                math.cos(2 * self.argpo)))
+        cc5 = 2 * coef1 * ao * omeosq * (1 + 2.75 * (etasq + eeta) +
+                                         eeta * etasq)
+        cosio4 = cosio2 * cosio2
+        temp1 = 1.5 * j2 * pinvsq * no
+        temp2 = 0.5 * temp1 * j2 * pinvsq
+        temp3 = -0.46875 * j4 * pinvsq * pinvsq * no
+        self.mdot = (no + 0.5 * temp1 * rteosq * con41 +
+                     0.0625 * temp2 * rteosq * (13 - 78 * cosio2 +
+                                                137 * cosio4))
+        self.argpdot = (-0.5 * temp1 * con42 +
+                        0.0625 * temp2 * (7 - 114 * cosio2 + 395 * cosio4) +
+                        temp3 * (3 - 36 * cosio2 + 49 * cosio4))
+        xhdot1 = -temp1 * cosio
+        self.nodedot = xhdot1 + (0.5 * temp2 * (4 - 19 * cosio2) +
+                                 2 * temp3 * (3 - 7 * cosio2)) * cosio
+        self.omgcof = bstar * cc3 * math.cos(self.argpo)
+        self.xmcof = 0
+        if ecco > 1e-4:
+            self.xmcof = -x2o3 * coef * bstar / eeta
+        self.nodecf = 3.5 * omeosq * xhdot1 * cc1
+        self.t2cof = 1.5 * cc1
+        if abs(cosio + 1) > 1.5e-12:
+            self.xlcof = -0.25 * j3oj2 * sinio * (3 + 5 * cosio) / (1 + cosio)
+        else:
+            self.xlcof = -0.25 * j3oj2 * sinio * (3 + 5 * cosio) / 1.5e-12
+        self.aycof = -0.5 * j3oj2 * sinio
+        self.delmo = (1 + eta * math.cos(self.mo)) ** 3
+        self.sinmao = math.sin(self.mo)
+        self.x7thm1 = 7 * cosio2 - 1
+        if not self.isimp:
+            cc1sq = cc1 * cc1
+            self.d2 = 4 * ao * tsi * cc1sq
+            temp = self.d2 * tsi * cc1 / 3
+            self.d3 = (17 * ao + sfour) * temp
+            self.d4 = 0.5 * temp * ao * tsi * (221 * ao + 31 * sfour) * cc1
+            self.t3cof = self.d2 + 2 * cc1sq
+            self.t4cof = 0.25 * (3 * self.d3 + cc1 * (12 * self.d2 +
+                                                      10 * cc1sq))
+            self.t5cof = 0.2 * (3 * self.d4 + 12 * cc1 * self.d3 +
+                                6 * self.d2 * self.d2 +
+                                15 * cc1sq * (2 * self.d2 + cc1sq))
+        self.no, self.eta, self.cc1, self.cc4, self.cc5 = no, eta, cc1, cc4, cc5
+        self.con41, self.x1mth2 = con41, x1mth2
+
+    def position(self, t):
+        # TEME position in km at t minutes since epoch (ndarray)
+        xke, j2, twopi = SGP4.XKE, SGP4.J2, 2 * np.pi
+        t = np.asarray(t, dtype=float)
+        xmdf = self.mo + self.mdot * t
+        argpdf = self.argpo + self.argpdot * t
+        nodedf = self.nodeo + self.nodedot * t
+        argpm = argpdf
+        mm = xmdf
+        t2 = t * t
+        nodem = nodedf + self.nodecf * t2
+        tempa = 1 - self.cc1 * t
+        tempe = self.bstar * self.cc4 * t
+        templ = self.t2cof * t2
+        if not self.isimp:
+            delomg = self.omgcof * t
+            delm = self.xmcof * ((1 + self.eta * np.cos(xmdf)) ** 3 -
+                                 self.delmo)
+            temp = delomg + delm
+            mm = xmdf + temp
+            argpm = argpdf - temp
+            t3 = t2 * t
+            t4 = t3 * t
+            tempa = tempa - self.d2 * t2 - self.d3 * t3 - self.d4 * t4
+            tempe = tempe + self.bstar * self.cc5 * (np.sin(mm) - self.sinmao)
+            templ = templ + self.t3cof * t3 + t4 * (self.t4cof +
+                                                    t * self.t5cof)
+        am = (xke / self.no) ** (2 / 3) * tempa * tempa
+        nm = xke / am ** 1.5
+        em = np.maximum(self.ecco - tempe, 1e-6)
+        mm = mm + self.no * templ
+        xlm = mm + argpm + nodem
+        nodem = np.fmod(nodem, twopi)
+        argpm = np.fmod(argpm, twopi)
+        xlm = np.fmod(xlm, twopi)
+        mm = np.fmod(xlm - argpm - nodem, twopi)
+
+        axnl = em * np.cos(argpm)
+        temp = 1 / (am * (1 - em * em))
+        aynl = em * np.sin(argpm) + temp * self.aycof
+        xl = mm + argpm + nodem + temp * self.xlcof * axnl
+        u = np.fmod(xl - nodem, twopi)
+        eo1 = u
+        for i in range(10):
+            sineo1 = np.sin(eo1)
+            coseo1 = np.cos(eo1)
+            tem5 = 1 - coseo1 * axnl - sineo1 * aynl
+            tem5 = (u - aynl * coseo1 + axnl * sineo1 - eo1) / tem5
+            eo1 = eo1 + np.clip(tem5, -0.95, 0.95)
+            if np.all(np.abs(tem5) < 1e-12):
+                break
+        sineo1 = np.sin(eo1)
+        coseo1 = np.cos(eo1)
+
+        ecose = axnl * coseo1 + aynl * sineo1
+        esine = axnl * sineo1 - aynl * coseo1
+        el2 = axnl * axnl + aynl * aynl
+        pl = am * (1 - el2)
+        rl = am * (1 - ecose)
+        betal = np.sqrt(1 - el2)
+        temp = esine / (1 + betal)
+        sinu = am / rl * (sineo1 - aynl - axnl * temp)
+        cosu = am / rl * (coseo1 - axnl + aynl * temp)
+        su = np.arctan2(sinu, cosu)
+        sin2u = (cosu + cosu) * sinu
+        cos2u = 1 - 2 * sinu * sinu
+        temp1 = 0.5 * j2 / pl
+        temp2 = temp1 / pl
+        cosip = np.cos(self.inclo)
+        sinip = np.sin(self.inclo)
+
+        mrt = (rl * (1 - 1.5 * temp2 * betal * self.con41) +
+               0.5 * temp1 * self.x1mth2 * cos2u)
+        su = su - 0.25 * temp2 * self.x7thm1 * sin2u
+        xnode = nodem + 1.5 * temp2 * cosip * sin2u
+        xinc = self.inclo + 1.5 * temp2 * cosip * sinip * cos2u
+
+        sinsu, cossu = np.sin(su), np.cos(su)
+        snod, cnod = np.sin(xnode), np.cos(xnode)
+        sini, cosi = np.sin(xinc), np.cos(xinc)
+        xmx = -snod * cosi
+        xmy = cnod * cosi
+        r = mrt * SGP4.Radius
+        return np.stack([r * (xmx * sinsu + cnod * cossu),
+                         r * (xmy * sinsu + snod * cossu),
+                         r * (sini * sinsu)], axis=-1)
+
+
+class LocalPredictor:
+    # Predicts visible passes from a TLE without any network access: the
+    # satellite must be above MinAltitude, sunlit, and the observer's sky
+    # darker than SunAltitude. Passes are searched on a Step seconds grid
+    # and refined to the second.
+    MinAltitude = 10
+    SunAltitude = -6
+    StandardMagnitude = -1.8
+    Step = 20
+    Chunk = 2 ** 20
+    EarthRadius = 6378.137
+    EarthFlattening = 1 / 298.257223563
+    # Passes predicted from an older TLE (plus the horizon) are off by
+    # minutes, or not passes at all: they are refused
+    MaxAge = timedelta(days=14)
+
+    def __init__(self, loc, tle, horizon=timedelta(days=10)):
+        self.location = loc
+        self.sgp4 = SGP4(*tle)
+        self.horizon = horizon
+        info('TLE epoch for NORAD {} is {}'.format(self.sgp4.satnum,
+                                                   self.sgp4.epoch))
+        if self._stale(datetime.utcnow()):
+            info('TLE for NORAD {} is too old, get a recent one'.format(
+                self.sgp4.satnum))
+
+    def name(self):
+        return "Local SGP4 prediction (NORAD {})".format(self.sgp4.satnum)
+
+    def key(self):
+        return 'sgp4:{}:{lat:.4f}:{lng:.4f}:{alt}'.format(self.sgp4.satnum,
+                                                          **self.location)
+
+    def get_next_visibles(self):
+        now = datetime.utcnow()
+        if self._stale(now):
+            raise ValueError('TLE for NORAD {} is {} days old'.format(
+                self.sgp4.satnum, (now - self.sgp4.epoch).days))
+        passes = self.predict(now - timedelta(minutes=15), now + self.horizon)
+        return [p for p in passes if p.EndTime > now]
+
+    def _stale(self, now):
+        return now - self.sgp4.epoch > LocalPredictor.MaxAge
+
+    def predict(self, start, end):
+        return self.predict_batch([self.location], start, end)[0]
+
+    def predict_batch(self, locations, start, end):
+        # Visible passes for many observers over the same time window. The
+        # satellite and Sun ephemerides are evaluated once and shared, only
+        # the topocentric geometry is computed per observer, in chunks of
+        # at most Chunk elements to bound memory.
+        obs, rot = LocalPredictor._observers(locations)
+        t = np.arange(0, (end - start).total_seconds(), LocalPredictor.Step)
+        sat, sun, sunlit = self._ephemeris(start, t)
+
+        # Only sunlit samples can be visible, and the coarse search only
+        # needs the altitude condition, which reduces to matrix products
+        lit = np.flatnonzero(sunlit)
+        sat, sun = sat[lit], sun[lit]
+        sat2 = np.sum(sat * sat, axis=1)[:, None]
+        min_alt = math.sin(math.radians(LocalPredictor.MinAltitude)) ** 2
+        max_sun = math.sin(math.radians(LocalPredictor.SunAltitude))
+        segments = []
+        size = max(1, LocalPredictor.Chunk // max(1, len(lit)))
+        for i in range(0, len(locations), size):
+            o, up = obs[i:i + size], rot[i:i + size, 2]
+            u = sat @ up.T - np.sum(o * up, axis=1)
+            d2 = sat2 - 2 * sat @ o.T + np.sum(o * o, axis=1)
+            visible = np.zeros((len(o), len(t) + 2), dtype=np.int8)
+            visible[:, lit + 1] = ((u > 0) & (u * u >= min_alt * d2) &
+                                   (sun @ up.T < max_sun)).T
+            edges = np.diff(visible, axis=1)
+            sites, starts = np.nonzero(edges == 1)
+            ends = np.nonzero(edges == -1)[1] - 1
+            segments.extend(zip(sites + i, starts, ends))
+
+        # Refine each candidate pass on a 1 second grid, sharing one
+        # ephemeris evaluation between all observers
+        windows = [(site, np.arange(t[a] - LocalPredictor.Step,
+                                    t[b] + LocalPredictor.Step + 1))
+                   for site, a, b in segments]
+        passes = [[] for l in locations]
+        if not windows:
+            return passes
+        fine = np.unique(np.concatenate([w for site, w in windows]))
+        sat, sun, sunlit = self._ephemeris(start, fine)
+
+        group = []
+        count = 0
+        for n, window in enumerate(windows):
+            group.append(window)
+            count = count + len(window[1])
+            if count < LocalPredictor.Chunk and n + 1 < len(windows):
+                continue
+            sites = np.concatenate([np.full(len(w), site) for site, w in group])
+            index = np.searchsorted(fine, np.concatenate([w for site, w in group]))
+            visible, alt, az, mag = LocalPredictor._look(
+                sat[index], sun[index], obs[sites], rot[sites])
+            visible = visible & sunlit[index]
+            offset = 0
+            for site, w in group:
+                s = slice(offset, offset + len(w))
+                offset = offset + len(w)
+                p = LocalPredictor._make_pass(self.sgp4.satnum, start, w,
+                                              visible[s], alt[s], az[s], mag[s])
+                if p is not None:
+                    passes[site].append(p)
+            group = []
+            count = 0
+        return passes
+
+    def _ephemeris(self, start, t):
+        # Satellite position (km, ECEF), Sun direction and sunlight at
+        # start + t seconds
+        jd = LocalPredictor._julian(start) + t / 86400
+        minutes = (t + (start - self.sgp4.epoch).total_seconds()) / 60
+        gmst = LocalPredictor._gmst(jd)
+        sat = LocalPredictor._teme_to_ecef(self.sgp4.position(minutes), gmst)
+        sun = LocalPredictor._teme_to_ecef(LocalPredictor._sun(jd), gmst)
+        along = np.sum(sat * sun, axis=-1)
+        shadow = np.linalg.norm(sat - along[..., None] * sun, axis=-1)
+        sunlit = (along > 0) | (shadow > LocalPredictor.EarthRadius)
+        return sat, sun, sunlit
+
+    @staticmethod
+    def _look(sat, sun, obs, rot):
+        # Dark sky and altitude condition, altitude, azimuth and magnitude
+        # of the satellite seen by the observers (broadcast)
+        d = sat - obs
+        rng = np.linalg.norm(d, axis=-1)
+        enu = np.einsum('...ij,...j->...i', rot, d)
+        alt = np.degrees(np.arcsin(enu[..., 2] / rng))
+        az = np.degrees(np.arctan2(enu[..., 0], enu[..., 1])) % 360
+        sun_alt = np.degrees(np.arcsin(np.sum(rot[..., 2, :] * sun, axis=-1)))
+
+        cos_phase = -np.sum(sun * d, axis=-1) / rng
+        phase = np.arccos(np.clip(cos_phase, -1, 1))
+        f = np.maximum(np.sin(phase) + (np.pi - phase) * cos_phase, 1e-6)
+        mag = (LocalPredictor.StandardMagnitude +
+               5 * np.log10(rng / 1000) - 2.5 * np.log10(f))
+
+        visible = ((alt >= LocalPredictor.MinAltitude) &
+                   (sun_alt < LocalPredictor.SunAltitude))
+        return visible, alt, az, mag
+
+    @staticmethod
+    def _make_pass(satid, start, t, visible, alt, az, mag):
+        segments = LocalPredictor._segments(visible)
+        if not segments:
+            return None
+        i0, i1 = max(segments, key=lambda s: s[1] - s[0])
+        ih = i0 + int(np.argmax(alt[i0:i1 + 1]))
+
+        p = Pass()
+        p.SatId = satid
+        p.StartTime = start + timedelta(seconds=float(t[i0]))
+        p.Date = p.StartTime.date()
+        p.Magnitude = round(float(mag[ih]), 1)
+        p.StartAltitude = float(round(alt[i0]))
+        p.StartAzimuth = round(float(az[i0]), 1)
+        p.HighTime = start + timedelta(seconds=float(t[ih]))
+        p.HighAltitude = float(round(alt[ih]))
+        p.HighAzimuth = round(float(az[ih]), 1)
+        p.EndTime = start + timedelta(seconds=float(t[i1]))
+        p.EndAltitude = float(round(alt[i1]))
+        p.EndAzimuth = round(float(az[i1]), 1)
+        for key in ['StartTime', 'HighTime', 'EndTime']:
+            setattr(p, key, getattr(p, key).replace(microsecond=0))
+        return p
+
+    @staticmethod
+    def _segments(mask):
+        edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+        return list(zip(np.flatnonzero(edges == 1),
+                        np.flatnonzero(edges == -1) - 1))
+
+    @staticmethod
+    def _observer(loc):
+        # WGS84 position (km, ECEF) and east/north/up rotation
+        lat = math.radians(loc['lat'])
+        lng = math.radians(loc['lng'])
+        h = loc['alt'] / 1000
+        e2 = LocalPredictor.EarthFlattening * (2 - LocalPredictor.EarthFlattening)
+        n = LocalPredictor.EarthRadius / math.sqrt(1 - e2 * math.sin(lat) ** 2)
+        obs = np.array([(n + h) * math.cos(lat) * math.cos(lng),
+                        (n + h) * math.cos(lat) * math.sin(lng),
+                        (n * (1 - e2) + h) * math.sin(lat)])
+        rot = np.array([[-math.sin(lng), math.cos(lng), 0],
+                        [-math.sin(lat) * math.cos(lng),
+                         -math.sin(lat) * math.sin(lng), math.cos(lat)],
+                        [math.cos(lat) * math.cos(lng),
+                         math.cos(lat) * math.sin(lng), math.sin(lat)]])
+        return obs, rot
+
+    @staticmethod
+    def _observers(locations):
+        observers = [LocalPredictor._observer(l) for l in locations]
+        return (np.array([o for o, r in observers]),
+                np.array([r for o, r in observers]))
+
+    @staticmethod
+    def _julian(t):
+        return 2440587.5 + (t - datetime(1970, 1, 1)).total_seconds() / 86400
+
+    @staticmethod
+    def _gmst(jd):
+        tut1 = (jd - 2451545) / 36525
+        g = (-6.2e-6 * tut1 ** 3 + 0.093104 * tut1 ** 2 +
+             (876600 * 3600 + 8640184.812866) * tut1 + 67310.54841)
+        return np.radians(g / 240) % (2 * np.pi)
+
+    @staticmethod
+    def _sun(jd):
+        # Unit vector to the Sun, low precision (Astronomical Almanac)
+        n = jd - 2451545
+        l = np.radians(280.460 + 0.9856474 * n)
+        g = np.radians(357.528 + 0.9856003 * n)
+        ecl = l + np.radians(1.915) * np.sin(g) + np.radians(0.020) * np.sin(2 * g)
+        eps = np.radians(23.439 - 0.0000004 * n)
+        return np.stack([np.cos(ecl),
+                         np.cos(eps) * np.sin(ecl),
+                         np.sin(eps) * np.sin(ecl)], axis=-1)
+
+    @staticmethod
+    def _teme_to_ecef(r, gmst):
+        c, s = np.cos(gmst), np.sin(gmst)
+        return np.stack([c * r[..., 0] + s * r[..., 1],
+                         -s * r[..., 0] + c * r[..., 1],
+                         r[..., 2]], axis=-1)
+
+
+class MultiProvider:
+    # Fetches from several providers (typically one per satellite) on a
+    # bounded thread pool and merges their passes in time order
+    def __init__(self, providers, workers=None):
+        self.providers = providers
+        self.executor = ThreadPoolExecutor(max_workers=workers or len(providers))
+
+    def name(self):
+        return ', '.join(p.name() for p in self.providers)
+
+    def key(self):
+        return '+'.join(p.key() for p in self.providers)
+
+    def get_next_visibles(self):
+        t0 = time.monotonic()
+        futures = [(p, self.executor.submit(p.get_next_visibles))
+                   for p in self.providers]
+        passes = []
+        error = None
+        for p, f in futures:
+            try:
+                passes.extend(f.result())
+            except Exception as e:
+                info('Fetch from "{}" failed:'.format(p.name()), e)
+                error = e
+        if error is not None and len(passes) == 0:
+            raise error
+        debug('Fetched {} providers in {:.3f}s'.format(len(self.providers),
+                                                      time.monotonic() - t0))
+        return sorted(passes, key=lambda p: p.StartTime)
+
+
+class CachedProvider:
+    # Serves the passes of another provider from a JSON file on disk.
+    # Stale or exhausted entries are refreshed in the background while the
+    # cached passes keep being served, and fetch errors (e.g. no network)
+    # fall back to whatever the cache holds.
+    FileLock = threading.Lock()
+
+    def __init__(self, provider, path, ttl):
+        self.provider = provider
+        self.path = path
+        self.ttl = ttl
+        self.key = provider.key()
+        self.passes = None
+        self.timestamp = None
+        self.refreshing = threading.Lock()
+        self._load()
+
+    def name(self):
+        return '{} (cached in {})'.format(self.provider.name(), self.path)
+
+    def get_next_visibles(self):
+        if self.passes is None:
+            self._refresh()
+        elif self._stale():
+            self._refresh_background()
+        now = datetime.utcnow()
+        return [p for p in self.passes or [] if p.EndTime > now]
+
+    def _stale(self):
+        now = datetime.utcnow()
+        if now - self.timestamp > self.ttl:
+            return True
+        return all(p.EndTime <= now for p in self.passes)
+
+    def _refresh_background(self):
+        if self.refreshing.locked():
+            return
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        if not self.refreshing.acquire(blocking=False):
+            return
+        try:
+            passes = self.provider.get_next_visibles()
+        except Exception as e:
+            info('Fetch from "{}" failed:'.format(self.provider.name()), e)
+            return
+        finally:
+            self.refreshing.release()
+        self.passes, self.timestamp = passes, datetime.utcnow()
+        debug('Cache refreshed with', len(passes), 'passes')
+        self._save()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        entry = self._read().get(self.key)
+        if entry is None:
+            return
+        self.passes = [Pass.from_dict(p) for p in entry['passes']]
+        self.timestamp = datetime.fromisoformat(entry['timestamp'])
+        info('Loaded', len(self.passes), 'cached passes from', self.timestamp)
+
+    def _save(self):
+        with CachedProvider.FileLock:
+            self._write()
+
+    def _write(self):
+        entries = self._read()
+        entries[self.key] = {'timestamp': self.timestamp.isoformat(),
+                             'passes': [p.to_dict() for p in self.passes]}
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            info('Cannot write cache "{}":'.format(self.path), e)
+
+
 class API:
     _provider = None
 
@@ -177,18 +1250,408 @@ class API:
         API._provider = provider
         info('Provider set to "{}"'.format(provider.name()))
 
+    @staticmethod
+    def set_listener(listener):
+        # Providers that push updates (PassServerProvider) call the
+        # listener from their own thread
+        if hasattr(API._provider, 'on_update'):
+            API._provider.on_update = listener
+
+    @staticmethod
+    def name():
+        if API._provider is None:
+            return 'None'
+        return API._provider.name()
+
     @staticmethod
     def get_next_visibles():
         if API._provider is None:
             return []
         return API._provider.get_next_visibles()
 
+    @staticmethod
+    def get_table():
+        return PassTable(API.get_next_visibles())
+
     @staticmethod
     def get_next_visible():
+        return API.get_table().next_after(datetime.utcnow())
+
+
+async def wait_event(event, timeout=None):
+    # Returns True when the asyncio event is set before the timeout. Unlike
+    # asyncio.wait_for, never loses a cancellation that comes with the event
+    # being set.
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        done, pending = await asyncio.wait([waiter], timeout=timeout)
+        return len(done) > 0
+    finally:
+        waiter.cancel()
+
+
+class Prefetcher:
+    # Refreshes the upcoming passes from the API every period or when asked
+    # to. The blocking fetch runs in the event loop's default executor, so
+    # the animations keep running while waiting for the network.
+    def __init__(self, period, passfilter=None):
+        self.period = period
+        self.passfilter = passfilter
+        self.wakeup = asyncio.Event()
+        self.fetched = asyncio.Event()
+        self.busy = False
+        self.raw = PassTable()
+        self.table = PassTable()
+        self.fetches = 0
+        self.failures = 0
+        self.error = None
+        self.updated = None
+        self.task = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.task = loop.create_task(self._run())
+        API.set_listener(lambda: loop.call_soon_threadsafe(self.refresh))
+
+    def stop(self):
+        API.set_listener(None)
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def refresh(self):
+        self.wakeup.set()
+
+    def get_table(self):
+        return self.table
+
+    def set_filter(self, passfilter):
+        # Applies at once to the passes already fetched
+        self.passfilter = passfilter
+        self.table = self._apply(self.raw, passfilter)
+
+    def next_visibles(self):
+        return self.get_table().upcoming(datetime.utcnow())
+
+    def next_visible(self):
+        return self.get_table().next_after(datetime.utcnow())
+
+    async def wait(self, timeout=None):
+        # Returns True when a fetch completes, successfully or not, before
+        # the timeout
+        return await wait_event(self.fetched, timeout)
+
+    async def fetch(self):
+        loop = asyncio.get_running_loop()
+        passfilter = self.passfilter
+        raw, table = await loop.run_in_executor(None, self._fetch, passfilter)
+        if passfilter is not self.passfilter:
+            # The filter changed during the fetch
+            table = self._apply(raw, self.passfilter)
+        return raw, table
+
+    def _fetch(self, passfilter):
+        raw = API.get_table()
+        return raw, self._apply(raw, passfilter)
+
+    @staticmethod
+    def _apply(table, passfilter):
+        if passfilter is None:
+            return table
+        return passfilter.apply(table)
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            self.busy = True
+            try:
+                self.raw, self.table = await self.fetch()
+                self.updated = datetime.utcnow()
+                self.error = None
+            except Exception as e:
+                info('Prefetch failed:', e)
+                self.failures += 1
+                self.error = str(e)
+            self.fetches += 1
+            self.busy = False
+            # Wakes up the current waiters, later ones wait for the next fetch
+            self.fetched.set()
+            self.fetched = asyncio.Event()
+            await wait_event(self.wakeup, self.period.total_seconds())
+
+
+class Geohash:
+    # Cells of the geohash grid, 5 characters are cells of about 5x5 km
+    Base32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+    @staticmethod
+    def encode(lat, lng, precision=5):
+        ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+        values = [lng, lat]
+        h = ''
+        bits = 0
+        while len(h) < precision:
+            n = 0
+            for i in range(5):
+                r, v = ranges[bits % 2], values[bits % 2]
+                mid = (r[0] + r[1]) / 2
+                if v >= mid:
+                    n = 2 * n + 1
+                    r[0] = mid
+                else:
+                    n = 2 * n
+                    r[1] = mid
+                bits += 1
+            h += Geohash.Base32[n]
+        return h
+
+    @staticmethod
+    def decode(h):
+        # Center of the cell, as (lat, lng)
+        ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+        bits = 0
+        for c in h:
+            n = Geohash.Base32.index(c)
+            for i in range(4, -1, -1):
+                r = ranges[bits % 2]
+                mid = (r[0] + r[1]) / 2
+                if (n >> i) & 1:
+                    r[0] = mid
+                else:
+                    r[1] = mid
+                bits += 1
+        return sum(ranges[1]) / 2, sum(ranges[0]) / 2
+
+
+class PassServer:
+    # Serves passes to many iss-py clients (PassServerProvider) over TCP
+    # ("host:port") or a Unix socket ("unix:/path"), with one JSON message
+    # per line. Clients subscribe with their location and satellites.
+    # Locations are grouped in geohash cells, the passes of each cell and
+    # satellite are fetched once for its center, every period, and pushed
+    # to all its subscribers when they change.
+    def __init__(self, address, make_provider, period, precision=5):
+        self.address = address
+        self.make_provider = make_provider
+        self.period = period
+        self.precision = precision
+        self.buckets = {}
+
+    @staticmethod
+    def parse_address(address):
+        if address.startswith('unix:'):
+            return address[len('unix:'):], None
+        host, port = address.rsplit(':', 1)
+        return host or '127.0.0.1', int(port)
+
+    @staticmethod
+    def connect(address):
+        host, port = PassServer.parse_address(address)
+        if port is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(host)
+            return sock
+        return socket.create_connection((host, port))
+
+    @staticmethod
+    async def listen(address, serve):
+        host, port = PassServer.parse_address(address)
+        if port is None:
+            if os.path.exists(host):
+                os.unlink(host)
+            return await asyncio.start_unix_server(serve, host)
+        return await asyncio.start_server(serve, host, port)
+
+    async def start(self):
+        return await PassServer.listen(self.address, self._serve)
+
+    async def run(self):
+        server = await self.start()
+        info('Serving passes on', self.address)
+        async with server:
+            await server.serve_forever()
+
+    async def _serve(self, reader, writer):
+        buckets = []
         try:
-            return API.get_next_visibles()[0]
-        except IndexError:
-            return None
+            async for line in reader:
+                request = json.loads(line).get('subscribe')
+                if request is None:
+                    continue
+                for satid in request.get('satids', [25544]):
+                    bucket = self._subscribe(request['lat'], request['lng'],
+                                             satid, writer)
+                    buckets.append(bucket)
+                    if bucket['message'] is not None:
+                        writer.write(bucket['message'])
+                await writer.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            debug('Pass server client failed:', e)
+        finally:
+            for bucket in buckets:
+                self._unsubscribe(bucket, writer)
+            writer.close()
+
+    def _subscribe(self, lat, lng, satid, writer):
+        key = (Geohash.encode(lat, lng, self.precision), satid)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            # Altitude changes pass times very little, the sea level is
+            # used for all the clients of a cell
+            lat, lng = Geohash.decode(key[0])
+            location = {'name': key[0], 'lat': round(lat, 4),
+                        'lng': round(lng, 4), 'alt': 0, 'tz': 'UTC'}
+            bucket = {'key': key,
+                      'provider': self.make_provider(location, satid),
+                      'subscribers': set(),
+                      'message': None,
+                      'task': None}
+            bucket['task'] = asyncio.get_running_loop().create_task(
+                self._follow(bucket))
+            self.buckets[key] = bucket
+            info('Following satellite {1} in cell {0}'.format(*key))
+        bucket['subscribers'].add(writer)
+        return bucket
+
+    def _unsubscribe(self, bucket, writer):
+        bucket['subscribers'].discard(writer)
+        if len(bucket['subscribers']) == 0 and bucket['key'] in self.buckets:
+            bucket['task'].cancel()
+            del self.buckets[bucket['key']]
+            info('Stopped following satellite {1} in cell {0}'.format(*bucket['key']))
+
+    async def _follow(self, bucket):
+        loop = asyncio.get_running_loop()
+        geohash, satid = bucket['key']
+        while True:
+            try:
+                passes = await loop.run_in_executor(
+                    None, bucket['provider'].get_next_visibles)
+                message = {'bucket': geohash, 'satid': satid,
+                           'passes': [p.to_dict() for p in passes]}
+                message = json.dumps(message).encode('utf-8') + b'\n'
+                if message != bucket['message']:
+                    bucket['message'] = message
+                    for writer in bucket['subscribers']:
+                        writer.write(message)
+                    debug('Pushed', len(passes), 'passes to',
+                          len(bucket['subscribers']), 'clients in', geohash)
+            except Exception as e:
+                info('Fetch for cell {} failed:'.format(geohash), e)
+            await asyncio.sleep(self.period.total_seconds())
+
+
+class StatusServer:
+    # Small HTTP/1.1 server on the event loop, for dashboards and scripts:
+    #     GET /status        phase, next pass, provider and display health
+    #     GET /passes        upcoming passes, with an ETag
+    #     GET /preferences   filters, tz, reminders (minutes), refresh (minutes)
+    #     POST /preferences  JSON object of the preferences to change
+    # The passes body is serialized once per table and first pass, polling
+    # it only costs the device a lookup.
+    Reasons = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request',
+               404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large'}
+    MaxBody = 16384
+
+    def __init__(self, isspy, address):
+        self.isspy = isspy
+        self.address = address
+        self.passes = None
+
+    async def start(self):
+        server = await PassServer.listen(self.address, self._serve)
+        info('Serving status on', self.address)
+        return server
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line.strip() == b'':
+                        break
+                    key, value = line.decode('latin-1').split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > StatusServer.MaxBody:
+                    self._respond(writer, 413, close=True)
+                    break
+                body = await reader.readexactly(length)
+                close = (version == 'HTTP/1.0' or
+                         headers.get('connection', '').lower() == 'close')
+                self._respond(writer, *self._handle(method, path, headers, body),
+                              close=close)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+            debug('Status client failed:', e)
+        finally:
+            writer.close()
+
+    def _handle(self, method, path, headers, body):
+        path = path.split('?', 1)[0]
+        if path == '/status':
+            if method != 'GET':
+                return (405,)
+            return 200, StatusServer.json(self.isspy.status_report())
+        if path == '/passes':
+            if method != 'GET':
+                return (405,)
+            body, etag = self._passes()
+            if etag in headers.get('if-none-match', ''):
+                return 304, b'', {'ETag': etag}
+            return 200, body, {'ETag': etag}
+        if path == '/preferences':
+            if method == 'GET':
+                return 200, StatusServer.json(self.isspy.preferences())
+            if method != 'POST':
+                return (405,)
+            try:
+                changes = json.loads(body)
+                if not isinstance(changes, dict):
+                    raise ValueError('Preferences must be a JSON object')
+                preferences = self.isspy.set_preferences(changes)
+            except ValueError as e:
+                return 400, StatusServer.json({'error': str(e)})
+            return 200, StatusServer.json(preferences)
+        return (404,)
+
+    def _passes(self):
+        table = self.isspy.prefetcher.get_table()
+        t = datetime.utcnow()
+        if (self.passes is None or self.passes[0] is not table or
+                t >= self.passes[1]):
+            passes = table.upcoming(t)
+            body = StatusServer.json([p.to_dict() for p in passes])
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            # The body changes when the table is replaced or its first
+            # pass ends
+            expires = passes[0].EndTime if len(passes) > 0 else datetime.max
+            self.passes = (table, expires, body, etag)
+        return self.passes[2], self.passes[3]
+
+    def _respond(self, writer, status, body=None, headers=None, close=False):
+        if body is None:
+            body = StatusServer.json({'error': StatusServer.Reasons[status]})
+        lines = ['HTTP/1.1 {} {}'.format(status, StatusServer.Reasons[status]),
+                 'Content-Length: {}'.format(len(body))]
+        if len(body) > 0:
+            lines.append('Content-Type: application/json')
+        lines += ['{}: {}'.format(k, v) for k, v in (headers or {}).items()]
+        if close:
+            lines.append('Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+    @staticmethod
+    def json(value):
+        return json.dumps(value).encode('utf-8')
 
 
 class Tween:
@@ -240,16 +1703,33 @@ class Tween:
 
 
 class Color:
-    Red = [255, 0, 0]
-    Green = [0, 255, 0]
-    Blue = [0, 0, 255]
-    White = [255, 255, 255]
-    Black = [0, 0, 0]
-    Yellow = [255, 255, 0]
+    Red = (255, 0, 0)
+    Green = (0, 255, 0)
+    Blue = (0, 0, 255)
+    White = (255, 255, 255)
+    Black = (0, 0, 0)
+    Yellow = (255, 255, 0)
+
+    # Each base color at the 256 intensities, as shared tuples, so that
+    # animations look colors up instead of building them every frame
+    Levels = 256
+    Palettes = {}
+
+    @staticmethod
+    def palette(c):
+        c = tuple(c)
+        try:
+            return Color.Palettes[c]
+        except KeyError:
+            n = Color.Levels - 1
+            palette = tuple(tuple(l * i // n for i in c) for l in range(n + 1))
+            Color.Palettes[c] = palette
+            return palette
 
     @staticmethod
     def scale(x, c):
-        return [int(x * i) for i in c]
+        n = Color.Levels - 1
+        return Color.palette(c)[min(max(int(x * n), 0), n)]
 
     @staticmethod
     def red(x):
@@ -272,89 +1752,414 @@ class Color:
         return Color.scale(x, Color.White)
 
 
-class Display:
-    def __init__(self):
+for c in [Color.Red, Color.Green, Color.Blue, Color.White, Color.Yellow]:
+    Color.palette(c)
+
+
+# Display backends have a name(), set_pixels(frame) taking an (8, 8, 3)
+# uint8 array, clear(), and a stick attribute, the Sense HAT joystick or None.
+
+class SenseHatBackend:
+    def __init__(self, rotation=180):
+        from sense_hat import SenseHat
         self.sense_hat = SenseHat()
         self.sense_hat.clear()
-        self.sense_hat.rotation = 180
-        self.pixels = [Color.Black] * 64
+        self.sense_hat.rotation = rotation
+        self.stick = self.sense_hat.stick
+
+    def name(self):
+        return "Sense HAT"
+
+    def set_pixels(self, frame):
+        self.sense_hat.set_pixels(frame.reshape(64, 3).tolist())
+
+    def clear(self):
+        self.sense_hat.clear()
+
+
+class FramebufferBackend:
+    # Writes frames straight into the memory-mapped Sense HAT framebuffer
+    # (or any file of 128 bytes) as RGB565, with per-channel lookup tables
+    # and the rotation applied as a pixel permutation.
+    Red = ((np.arange(256) >> 3) << 11).astype(np.uint16)
+    Green = ((np.arange(256) >> 2) << 5).astype(np.uint16)
+    Blue = (np.arange(256) >> 3).astype(np.uint16)
+    Size = 64 * 2
+
+    def __init__(self, path=None, rotation=180):
+        if path is None:
+            path = FramebufferBackend.find()
+        self.path = path
+        self.file = open(path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), FramebufferBackend.Size)
+        # Same orientation as SenseHat.rotation
+        layout = np.rot90(np.arange(64).reshape(8, 8), rotation // 90)
+        self.order = np.argsort(layout.ravel())
+        self.stick = None
+        try:
+            from sense_hat.stick import SenseStick
+            self.stick = SenseStick()
+        except (ImportError, OSError):
+            pass
+        self.clear()
+
+    def name(self):
+        return "Framebuffer ({})".format(self.path)
+
+    def set_pixels(self, frame):
+        rgb = (FramebufferBackend.Red[frame[..., 0]] |
+               FramebufferBackend.Green[frame[..., 1]] |
+               FramebufferBackend.Blue[frame[..., 2]])
+        self.mmap[:] = rgb.ravel()[self.order].astype('<u2').tobytes()
+
+    def clear(self):
+        self.mmap[:] = bytes(FramebufferBackend.Size)
+
+    @staticmethod
+    def find():
+        for fb in sorted(os.listdir('/sys/class/graphics')):
+            try:
+                with open(os.path.join('/sys/class/graphics', fb, 'name')) as f:
+                    if f.read().strip() == 'RPi-Sense FB':
+                        return os.path.join('/dev', fb)
+            except OSError:
+                pass
+        raise OSError('Sense HAT framebuffer not found')
+
+
+class RecordingBackend:
+    # Headless display keeping the last frames written, with their
+    # time.monotonic() timestamps, in a ring buffer. The recording can be
+    # saved as a binary frame log or as a PNG strip of the frames.
+    Magic = b'ISSF'
+    Record = np.dtype([('time', '<f8'), ('rgb', 'u1', (8, 8, 3))])
+
+    def __init__(self, size=4096):
+        self.records = np.zeros(size, dtype=RecordingBackend.Record)
+        self.count = 0
+        self.stick = None
+
+    def name(self):
+        return "Recording ({} frames)".format(len(self.records))
+
+    def set_pixels(self, frame):
+        record = self.records[self.count % len(self.records)]
+        record['time'] = time.monotonic()
+        record['rgb'] = frame
+        self.count += 1
+
+    def clear(self):
+        self.set_pixels(np.zeros((8, 8, 3), dtype=np.uint8))
+
+    def recorded(self):
+        # Recorded frames, oldest first
+        n = min(self.count, len(self.records))
+        return self.records[np.arange(self.count - n, self.count) %
+                            len(self.records)]
+
+    def dump(self, path):
+        if path.endswith('.png'):
+            self.dump_png(path)
+            return
+        records = self.recorded()
+        with open(path, 'wb') as f:
+            f.write(RecordingBackend.Magic + struct.pack('<I', len(records)))
+            f.write(records.tobytes())
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            if f.read(4) != RecordingBackend.Magic:
+                raise ValueError('Not a frame log: {}'.format(path))
+            n, = struct.unpack('<I', f.read(4))
+            return np.frombuffer(f.read(), dtype=RecordingBackend.Record,
+                                 count=n)
+
+    def dump_png(self, path, columns=32, scale=4):
+        # Frames left to right and top to bottom, separated by one pixel
+        rgb = self.recorded()['rgb']
+        rows = max(1, -(-len(rgb) // columns))
+        cell = 8 * scale + 1
+        image = np.full((rows * cell, min(columns, max(1, len(rgb))) * cell, 3),
+                        64, dtype=np.uint8)
+        for i, frame in enumerate(rgb):
+            y, x = (i // columns) * cell, (i % columns) * cell
+            image[y:y + 8 * scale, x:x + 8 * scale] = frame.repeat(
+                scale, axis=0).repeat(scale, axis=1)
+        RecordingBackend._write_png(path, image)
+
+    @staticmethod
+    def _write_png(path, image):
+        def chunk(kind, data):
+            return (struct.pack('>I', len(data)) + kind + data +
+                    struct.pack('>I', zlib.crc32(kind + data)))
+        h, w = image.shape[:2]
+        scanlines = np.zeros((h, 1 + 3 * w), dtype=np.uint8)
+        scanlines[:, 1:] = image.reshape(h, 3 * w)
+        with open(path, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)))
+            f.write(chunk(b'IDAT', zlib.compress(scanlines.tobytes())))
+            f.write(chunk(b'IEND', b''))
+
+
+class Bitboard:
+    # 8x8 masks as 64-bit ints, with bit y * 8 + x set for pixel (x, y).
+    # Masks move with shifts, after clearing the columns that would wrap
+    # into the next row.
+    Full = (1 << 64) - 1
+    # Columns kept by a horizontal move of dx
+    Keep = {dx: ((0xFF >> dx) if dx >= 0 else (0xFF << -dx) & 0xFF) * 0x0101010101010101
+            for dx in range(-7, 8)}
+
+    @staticmethod
+    def from_mask(mask):
+        # From a 0/1 mask of up to 8x8 pixels, placed at (0, 0)
+        if isinstance(mask, int):
+            return mask
+        m = np.asarray(mask)[:8, :8] > 0
+        bits = np.zeros((8, 8), dtype=bool)
+        bits[:m.shape[0], :m.shape[1]] = m
+        return int(np.packbits(bits, bitorder='little').view('<u8')[0])
+
+    @staticmethod
+    def shift(board, dx, dy):
+        if not (-8 < dx < 8 and -8 < dy < 8):
+            return 0
+        board = board & Bitboard.Keep[dx]
+        n = dx + 8 * dy
+        if n >= 0:
+            return (board << n) & Bitboard.Full
+        return board >> -n
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def mask(board):
+        # Read-only (64,) bool array of the pixels, in Display.pixels order
+        m = np.unpackbits(np.array([board], dtype='<u8').view(np.uint8),
+                          bitorder='little') > 0
+        m.flags.writeable = False
+        return m
+
+
+class Display:
+    # The frame is an (8, 8, 3) uint8 array indexed [y, x]. Patterns are
+    # thresholds over fields precomputed for the 64 pixel centers.
+    Y, X = np.mgrid[0:8, 0:8] + 0.5 - 4
+    # Clockwise angle from the top, as a fraction of a turn
+    Angle = np.round(np.arctan2(X, -Y) / (2 * np.pi) % 1, 3)
+    # Squared distance to the center
+    Distance2 = X ** 2 + Y ** 2
+    EdgeX = [4, 5, 6, 7,
+             7, 7, 7, 7, 7, 7, 7,
+             6, 5, 4, 3, 2, 1, 0,
+             0, 0, 0, 0, 0, 0, 0,
+             1, 2, 3]
+    EdgeY = [0, 0, 0, 0,
+             1, 2, 3, 4, 5, 6, 7,
+             7, 7, 7, 7, 7, 7, 7,
+             6, 5, 4, 3, 2, 1, 0,
+             0, 0, 0]
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = SenseHatBackend()
+        self.backend = backend
+        self.pixels = np.zeros((8, 8, 3), dtype=np.uint8)
         self.enabled = True
+        # Last frame written, show() calls deferred by tick()
+        self.sent = self.pixels.tobytes()
+        self.deferred = 0
+        self.pending = False
+        self.frames_sent = 0
+        self.frames_skipped = 0
 
     def disable(self):
         self.enabled = False
-        self.sense_hat.clear()
+        self.backend.clear()
+        self.sent = bytes(len(self.sent))
 
     def enable(self):
         self.enabled = True
 
     def clear(self):
-        for i in range(64):
-            self.pixels[i] = Color.Black
+        self.pixels[:] = 0
 
     def show(self):
-        if self.enabled:
-            self.sense_hat.set_pixels(self.pixels)
+        if self.deferred > 0:
+            if self.pending:
+                self.frames_skipped += 1
+            self.pending = True
+        else:
+            self._write()
+
+    @contextmanager
+    def tick(self):
+        # Coalesces the show() calls of one animation tick into one write
+        self.deferred += 1
+        try:
+            yield self
+        finally:
+            self.deferred -= 1
+            if self.deferred == 0 and self.pending:
+                self.pending = False
+                self._write()
+
+    def _write(self):
+        if not self.enabled:
+            return
+        frame = self.pixels.tobytes()
+        if frame == self.sent:
+            self.frames_skipped += 1
+            return
+        self.backend.set_pixels(self.pixels)
+        self.sent = frame
+        self.frames_sent += 1
 
     def set(self, x, y, c):
-        self.pixels[8 * y + x] = c
+        self.pixels[y, x] = c
 
     def pie(self, x, c):
-        lut = [0.875, 0.901, 0.936, 0.977, 0.023, 0.064, 0.099, 0.125,
-               0.849, 0.875, 0.914, 0.969, 0.031, 0.086, 0.125, 0.151,
-               0.814, 0.836, 0.875, 0.949, 0.051, 0.125, 0.164, 0.186,
-               0.773, 0.781, 0.801, 0.875, 0.125, 0.199, 0.219, 0.227,
-               0.727, 0.719, 0.699, 0.625, 0.375, 0.301, 0.281, 0.273,
-               0.686, 0.664, 0.625, 0.551, 0.449, 0.375, 0.336, 0.314,
-               0.651, 0.625, 0.586, 0.531, 0.469, 0.414, 0.375, 0.349,
-               0.625, 0.599, 0.564, 0.523, 0.477, 0.436, 0.401, 0.375]
-        for i in range(64):
-            if lut[i] <= x:
-                self.pixels[i] = c
+        self.pixels[Display.Angle <= x] = c
 
     def spot(self, x, c):
         r = 3.5 * 1.4142 * x
         r2 = int(r**2)
         r3 = int(1.4 * r**2)
-        d2 = [24.5, 18.5, 14.5, 12.5, 12.5, 14.5, 18.5, 24.5,
-              18.5, 12.5,  8.5,  6.5,  6.5,  8.5, 12.5, 18.5,
-              14.5,  8.5,  4.5,  2.5,  2.5,  4.5,  8.5, 14.5,
-              12.5,  6.5,  2.5,  0.5,  0.5,  2.5,  6.5, 12.5,
-              12.5,  6.5,  2.5,  0.5,  0.5,  2.5,  6.5, 12.5,
-              14.5,  8.5,  4.5,  2.5,  2.5,  4.5,  8.5, 14.5,
-              18.5, 12.5,  8.5,  6.5,  6.5,  8.5, 12.5, 18.5,
-              24.5, 18.5, 14.5, 12.5, 12.5, 14.5, 18.5, 24.5]
-        for i in range(64):
-            if d2[i] <= r2:
-                self.pixels[i] = c
-            elif d2[i] <= r3:
-                z = (r3 - d2[i]) / (r3 - r2)
-                self.pixels[i] = Color.scale(x, c)
+        self.pixels[Display.Distance2 <= r3] = Color.scale(x, c)
+        self.pixels[Display.Distance2 <= r2] = c
 
     def edge(self, az, c):
         ai = int(az / 12.857143)
-        x = [4, 5, 6, 7,
-             7, 7, 7, 7, 7, 7, 7,
-             6, 5, 4, 3, 2, 1, 0,
-             0, 0, 0, 0, 0, 0, 0,
-             1, 2, 3][ai]
-        y = [0, 0, 0, 0,
-             1, 2, 3, 4, 5, 6, 7,
-             7, 7, 7, 7, 7, 7, 7,
-             6, 5, 4, 3, 2, 1, 0,
-             0, 0, 0][ai]
-        self.set(x, y, c)
+        self.set(Display.EdgeX[ai], Display.EdgeY[ai], c)
+
+    def fill(self, board, c):
+        if board:
+            self.pixels.reshape(64, 3)[Bitboard.mask(board)] = c
 
     def draw(self, mask, dx, dy, c):
+        if isinstance(mask, int):
+            self.fill(Bitboard.shift(mask, dx, dy), c)
+            return
         sy, sx = len(mask), len(mask[0])
         x0 = max(0, -dx)
-        x1 = min(sx, 8 - dx) 
+        x1 = min(sx, 8 - dx)
         y0 = max(0, -dy)
         y1 = min(sy, 8 - dy)
-##        debug(mask, (dx, dy), (x0, x1), (y0, y1))
-        for y in range(y0, y1):
-            for x in range(x0, x1):
-                if mask[y][x] > 0:
-                    self.pixels[8 * (y + dy) + (x + dx)] = c
+        if x0 >= x1 or y0 >= y1:
+            return
+        m = np.asarray(mask)[y0:y1, x0:x1]
+        if m.dtype != bool:
+            m = m > 0
+        self.pixels[y0 + dy:y1 + dy, x0 + dx:x1 + dx][m] = c
+
+
+class Layer:
+    # Display backend of a compositor layer: frames are kept for the
+    # compositor instead of being written out
+    def __init__(self, compositor, priority, opaque=False, expires=None):
+        self.compositor = compositor
+        self.priority = priority
+        self.opaque = opaque
+        self.expires = expires
+        self.frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        self.stick = None
+
+    def name(self):
+        return 'Layer {}'.format(self.priority)
+
+    def set_pixels(self, frame):
+        self.frame[:] = frame
+        self.compositor.invalidate()
+
+    def clear(self):
+        self.frame[:] = 0
+        self.compositor.invalidate()
+
+
+class Compositor:
+    # Owns the display backend. Producers draw on their own layer, a
+    # Display on a Layer backend, and the render task composites the
+    # layers by priority into at most one frame per T.AnimationUpdate,
+    # only when a layer changed. Black pixels are transparent except on
+    # opaque layers. Layers with a lifetime are removed when it is over.
+    Base = 0
+    Status = 10
+    Overlay = 20
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.layers = []
+        self.frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        self.sent = self.frame.tobytes()
+        self.dirty = asyncio.Event()
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        # Called once, after the first frame is written to the backend
+        self.on_first_frame = None
+
+    def layer(self, priority, opaque=False, lifetime=None):
+        expires = None if lifetime is None else time.monotonic() + lifetime
+        display = Display(Layer(self, priority, opaque, expires))
+        self.layers.append(display.backend)
+        self.layers.sort(key=lambda l: l.priority)
+        return display
+
+    def remove(self, display):
+        if display.backend in self.layers:
+            self.layers.remove(display.backend)
+            self.invalidate()
+
+    @contextmanager
+    def overlay(self, priority, opaque=False, lifetime=None):
+        display = self.layer(priority, opaque, lifetime)
+        try:
+            yield display
+        finally:
+            self.remove(display)
+
+    def invalidate(self):
+        self.dirty.set()
+
+    def composite(self):
+        self.frame[:] = 0
+        for layer in self.layers:
+            if layer.opaque:
+                self.frame[:] = layer.frame
+            else:
+                m = layer.frame.any(axis=2)
+                self.frame[m] = layer.frame[m]
+        return self.frame
+
+    async def run(self):
+        last = time.monotonic() - T.AnimationUpdate
+        while True:
+            expires = [l.expires for l in self.layers if l.expires is not None]
+            timeout = None
+            if len(expires) > 0:
+                timeout = max(0, min(expires) - time.monotonic())
+            await wait_event(self.dirty, timeout)
+            delay = last + T.AnimationUpdate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.dirty.clear()
+            last = time.monotonic()
+            self.layers = [l for l in self.layers
+                           if l.expires is None or l.expires > last]
+            self.render()
+
+    def render(self):
+        frame = self.composite()
+        data = frame.tobytes()
+        if data == self.sent:
+            self.frames_skipped += 1
+            return
+        self.backend.set_pixels(frame)
+        self.sent = data
+        self.frames_sent += 1
+        if self.on_first_frame is not None:
+            on_first_frame, self.on_first_frame = self.on_first_frame, None
+            on_first_frame()
 
 
 class S:
@@ -386,30 +2191,42 @@ class S:
                [0, 0, 0, 0, 0, 0, 0, 0],
                [0, 0, 0, 1, 1, 0, 0, 0],
                [0, 0, 0, 1, 1, 0, 0, 0]]
-    data = 'eNp1kgkOACEIA4f/f3o3HqWixBjkKlgggvgvQzLe0ilvWD' \
-           'ZWfFzyeUbCxs4a21cvVlE1h0Q6Myx9Xe0Z1nhWX4bH05tI' \
-           '+oNxIT2srzjR9FeSg9oX4RgUW+Xo4IueL8O+Ypw/MmvH2p' \
-           'zItop+VuLFnvrec+KeP2V/RGXYzt28yQaPPer5+gAhdQFn'
-    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ 0123456789'
+    # 4x5 font atlas, one int per glyph: five 4-bit rows with the top
+    # row in the high bits, and the leftmost pixel first in each row
+    Font = {'A': 0x6aeaa, 'B': 0xeacae, 'C': 0x6888e, 'D': 0xcaaac, 'E': 0xe8c8e,
+            'F': 0xe8c88, 'G': 0x688ae, 'H': 0xaaeaa, 'I': 0xe444e, 'J': 0x622ae,
+            'K': 0xaacaa, 'L': 0x8888e, 'M': 0xaeaaa, 'N': 0xcaaaa, 'O': 0x6aaac,
+            'P': 0xeae88, 'Q': 0x6aac6, 'R': 0xeacaa, 'S': 0x68e2c, 'T': 0xe4444,
+            'U': 0xaaaae, 'V': 0xaaae4, 'W': 0xaaaea, 'X': 0xaa4aa, 'Y': 0xaae44,
+            'Z': 0xe248e, ' ': 0x00000, '0': 0xeaaae, '1': 0xc444e, '2': 0xe2e8e,
+            '3': 0xe262e, '4': 0xaae22, '5': 0xe8e2e, '6': 0xe8eae, '7': 0xe2222,
+            '8': 0xeaeae, '9': 0xeae2e, ':': 0x04040}
     letters = {}
     digits = []
 
     @staticmethod
     def init():
-        import zlib, base64
-        pixels = zlib.decompress(base64.b64decode(S.data))
-        pixels = [pixels[152*i:152*(i+1)] for i in range(5)]
-        S.letters = {}
-        for i in range(len(S.alphabet)):
-            l = S.alphabet[i]
-            letter = [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
-            for y in range(5):
-                for x in range(4):
-                    letter[y][x] = pixels[y][4 * i + x]
-            S.letters[l] = letter
-        for n in range(10):
-            d = str(n)
-            S.digits.append(S.letters[d])
+        for name in ['iss_body', 'iss_panels', 'email', 'no_pass']:
+            setattr(S, name, Bitboard.from_mask(getattr(S, name)))
+        S.letters = {l: S.unpack(bits) for l, bits in S.Font.items()}
+        S.digits = [Bitboard.from_mask(S.letters[str(n)]) for n in range(10)]
+        S.text.cache_clear()
+
+    @staticmethod
+    def unpack(bits):
+        glyph = np.unpackbits(np.array([bits], '>u4').view(np.uint8))
+        glyph = glyph[-20:].reshape(5, 4) > 0
+        glyph.flags.writeable = False
+        return glyph
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def text(text):
+        # Text rendered into one 5-row strip, 4 columns per character
+        blank = S.letters[' ']
+        strip = np.hstack([blank[:, :0]] + [S.letters.get(l, blank) for l in text])
+        strip.flags.writeable = False
+        return strip
 
     @staticmethod
     def letter(l):
@@ -440,14 +2257,23 @@ class T:
     BlinkUp = 0.1
     StatusUpdate = 2
     OnlineUpdate = 10
-    SpinStep = 0.1
+    OnlineTimeout = 30
+    FetchWorkers = 4
+    StandbyUpdate = 15
+    ClockCheck = 60
     AnimationUpdate = 0.1
     CountdownDuration = timedelta(seconds=60)
     SetupDuration = timedelta(seconds=15)
     NotifyPassDuration = timedelta(seconds=2)
     NotifyFadeDuration = timedelta(seconds=1)
     NotifyTextDuration = timedelta(seconds=1)
+    MarqueeStep = 0.1
     SplashDuration = timedelta(seconds=2)
+    SplashBudget = 3
+    Debounce = 0.3
+    OverlayLifetime = 15
+    CacheTTL = timedelta(hours=6)
+    PrefetchPeriod = timedelta(minutes=30)
 
     # Lowrez
 ##    BlinkUp = 0.1
@@ -459,127 +2285,294 @@ class T:
 ##    SetupDuration = timedelta(seconds=60)
 
 
-def blink(display, c):
+class Frames:
+    # Fixed-rate animation clock: frame n is due at start + n * period on
+    # time.monotonic(). Rendering late does not shift the following frames,
+    # the frames whose deadline has already passed are dropped instead.
+    def __init__(self, period, count=None, until=None):
+        self.period = period
+        self.count = count
+        self.until = until
+        self.start = None
+        self.stop = None
+        self.frames = 0
+        self.overruns = 0
+        self.lateness = 0
+        self.lateness2 = 0
+
+    async def __aiter__(self):
+        self.start = time.monotonic()
+        n = 0
+        while ((self.count is None or n < self.count) and
+               (self.until is None or self.time(n) < self.until)):
+            delay = self.time(n) - time.monotonic()
+            await asyncio.sleep(max(0, delay))
+            late = time.monotonic() - self.time(n)
+            self.frames += 1
+            self.lateness += late
+            self.lateness2 += late * late
+            yield n
+            due = int((time.monotonic() - self.start) / self.period) + 1
+            if due > n + 1:
+                self.overruns += due - n - 1
+                n = due
+            else:
+                n = n + 1
+        # The last frame stays on until its period or the animation ends
+        end = self.time(n) if self.until is None else min(self.time(n), self.until)
+        await asyncio.sleep(max(0, end - time.monotonic()))
+        self.stop = time.monotonic()
+
+    def __str__(self):
+        return '{} frames, {:.1f} fps, jitter {:.1f} ms, {} overruns'.format(
+            self.frames, self.fps(), 1000 * self.jitter(), self.overruns)
+
+    def time(self, n):
+        return self.start + n * self.period
+
+    def fps(self):
+        if self.start is None:
+            return 0
+        elapsed = (self.stop or time.monotonic()) - self.start
+        return self.frames / elapsed if elapsed > 0 else 0
+
+    def jitter(self):
+        if self.frames == 0:
+            return 0
+        mean = self.lateness / self.frames
+        return math.sqrt(max(0, self.lateness2 / self.frames - mean * mean))
+
+    @staticmethod
+    def monotonic(t):
+        # time.monotonic() value of a UTC datetime
+        return time.monotonic() + (t - datetime.utcnow()).total_seconds()
+
+
+class Track:
+    # Sky path of a pass, sampled every period seconds when the pass is
+    # loaded: great circle arcs from the start to the highest point and
+    # from there to the end, and where each sample falls on the 8x8 polar
+    # sky view (zenith at the center, horizon at the border, north up).
+    def __init__(self, p, period=T.AnimationUpdate):
+        self.period = period
+        t1 = (p.HighTime - p.StartTime).total_seconds()
+        t2 = (p.EndTime - p.StartTime).total_seconds()
+        t = np.arange(max(1, math.ceil(t2 / period))) * period
+        v0 = Track._vector(p.StartAltitude, p.StartAzimuth)
+        v1 = Track._vector(p.HighAltitude, p.HighAzimuth)
+        v2 = Track._vector(p.EndAltitude, p.EndAzimuth)
+        x1 = np.clip(t / t1, 0, 1) if t1 > 0 else np.ones_like(t)
+        x2 = np.clip((t - t1) / (t2 - t1), 0, 1) if t2 > t1 else np.zeros_like(t)
+        v = np.where((t < t1)[:, None],
+                     Track._slerp(v0, v1, x1), Track._slerp(v1, v2, x2))
+        self.alt = np.degrees(np.arcsin(np.clip(v[:, 2], -1, 1)))
+        self.az = np.degrees(np.arctan2(v[:, 0], v[:, 1])) % 360
+
+        r = 4 * (90 - np.clip(self.alt, 0, 90)) / 90
+        a = np.radians(self.az)
+        x = np.clip(np.floor(4 + r * np.sin(a)), 0, 7).astype(np.uint64)
+        y = np.clip(np.floor(4 - r * np.cos(a)), 0, 7).astype(np.uint64)
+        boards = np.left_shift(np.uint64(1), y * np.uint64(8) + x)
+        # Bitboards of the satellite, of the track so far and of the whole track
+        self.position = tuple(int(b) for b in boards)
+        self.trail = tuple(int(b) for b in np.bitwise_or.accumulate(boards))
+        self.path = self.trail[-1]
+
+    def __len__(self):
+        return len(self.position)
+
+    def index(self, dt):
+        # Sample at dt seconds into the pass
+        n = int(round(dt / self.period))
+        return min(max(n, 0), len(self.position) - 1)
+
+    @staticmethod
+    def _vector(alt, az):
+        # East, north, up unit vector
+        alt, az = math.radians(alt), math.radians(az)
+        return np.array([math.cos(alt) * math.sin(az),
+                         math.cos(alt) * math.cos(az),
+                         math.sin(alt)])
+
+    @staticmethod
+    def _slerp(a, b, x):
+        omega = math.acos(min(1, max(-1, float(np.dot(a, b)))))
+        if math.sin(omega) < 1e-6:
+            v = np.outer(1 - x, a) + np.outer(x, b)
+            return v / np.linalg.norm(v, axis=1)[:, None]
+        return (np.outer(np.sin((1 - x) * omega), a) +
+                np.outer(np.sin(x * omega), b)) / math.sin(omega)
+
+
+class Timeline:
+    # The schedule of a pass, compiled once: a sorted tuple of
+    # (time, kind, data) events, the reminders and phase changes, and the
+    # track that monitor follows.
+    Reminders = ((timedelta(hours=24), '1D'),
+                 (timedelta(hours=12), '12H'),
+                 (timedelta(hours=6), '6H'),
+                 (timedelta(hours=3), '3H'),
+                 (timedelta(hours=2), '2H'),
+                 (timedelta(hours=1), '1H'),
+                 (timedelta(minutes=45), '45'),
+                 (timedelta(minutes=30), '30'),
+                 (timedelta(minutes=15), '15'),
+                 (timedelta(minutes=10), '10'),
+                 (timedelta(minutes=5), '5'),
+                 (timedelta(minutes=2), '2'))
+    # Reminders missed by more than this are not shown
+    Late = timedelta(seconds=15)
+
+    def __init__(self, next_pass, reminders=Reminders, period=T.AnimationUpdate):
+        self.next_pass = next_pass
+        self.start = next_pass.StartTime
+        self.setup = self.start - T.SetupDuration
+        self.countdown = self.setup - T.CountdownDuration
+        self.end = next_pass.EndTime
+        events = [(self.start - dt, 'reminder', text)
+                  for dt, text in reminders
+                  if self.start - dt < self.countdown]
+        events += [(self.countdown, 'countdown', None),
+                   (self.setup, 'setup', None),
+                   (self.start, 'monitor', None),
+                   (self.end, 'end', None)]
+        self.events = tuple(sorted(events, key=lambda e: e[0]))
+        self.track = Track(next_pass, period)
+
+    def __str__(self):
+        return '\n'.join('{:%Y-%m-%d %H:%M:%S} {:<9} {}'.format(t, kind, data or '')
+                         for t, kind, data in self.events)
+
+    def pending(self, t):
+        return [e for e in self.events
+                if e[1] != 'reminder' or e[0] > t - Timeline.Late]
+
+
+class Runner:
+    # Runs (time, kind, data) events in time order from a heap, sleeping
+    # until the next one. Events due at the same time run in the order they
+    # were added, and the handler may add events while running.
+    def __init__(self, handler):
+        self.handler = handler
+        self.heap = []
+        self.count = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def at(self, t, kind, data=None):
+        heapq.heappush(self.heap, (t, self.count, kind, data))
+        self.count += 1
+
+    async def run(self):
+        while len(self.heap) > 0:
+            t, _, kind, data = heapq.heappop(self.heap)
+            await sleep_until(t)
+            await self.handler(t, kind, data)
+
+
+async def blink(display, c):
     display.set(7, 7, c)
     display.show()
 
-    time.sleep(T.BlinkUp)
+    await asyncio.sleep(T.BlinkUp)
 
     display.set(7, 7, Color.Black)
     display.show()
 
 
-def spin_until(t, step=T.SpinStep):
-    while datetime.utcnow() < t:
-        time.sleep(step)
+async def sleep_until(t):
+    # Sleeps until a UTC datetime, checking the wall clock at least every
+    # T.ClockCheck seconds in case it is set meanwhile
+    while True:
+        dt = (t - datetime.utcnow()).total_seconds()
+        if dt <= 0:
+            return
+        await asyncio.sleep(min(dt, T.ClockCheck))
 
 
-def search(display):
+async def search(display, status, prefetcher):
     display.clear()
     display.show()
 
-    t0 = datetime.fromordinal(1)
+    t0 = time.monotonic() + T.OnlineUpdate
     while True:
-        t = datetime.utcnow()
-        if t >= t0:
-            display.set(7, 7, Color.yellow(0.5))
-            display.show()
+        next_pass = prefetcher.next_visible()
+        if next_pass is not None:
+            return next_pass
 
-            next_pass = API.get_next_visible()
-
-            display.set(7, 7, Color.Black)
-            display.show()
-
-            if next_pass is not None:
-                return next_pass
-
-            t0 = t + timedelta(seconds=T.OnlineUpdate)
+        t = time.monotonic()
+        if t >= t0:
+            prefetcher.refresh()
+            t0 = t + T.OnlineUpdate
 
-        blink(display, Color.red(0.5))
-        time.sleep(T.StatusUpdate)
+        if prefetcher.busy:
+            await blink(status, Color.yellow(0.5))
+        else:
+            await blink(status, Color.red(0.5))
+        await prefetcher.wait(T.StatusUpdate)
 
 
-def notify_sprite(display, sprites, xs, ys, color):
-    for d in range(-7, 7):
+async def fly_by(display):
+    frames = Frames(T.AnimationUpdate, 14)
+    async for i in frames:
+        d = i - 7
         display.clear()
         display.draw(S.iss_body, d, -d, Color.White)
         display.draw(S.iss_panels, d, -d, Color.Yellow)
         display.show()
-        time.sleep(T.AnimationUpdate)
+    debug('fly_by:', frames)
 
-    display.clear()
-    steps = int(T.NotifyFadeDuration.total_seconds() / T.AnimationUpdate)
-    for t in range(steps):
-        for s, x, y in zip(sprites, xs, ys):
-            display.draw(s, x, y, Color.scale(t / steps, color))
-            display.show()
-        time.sleep(T.AnimationUpdate)
-    time.sleep(T.NotifyTextDuration.total_seconds())
-    for t in range(steps):
-        for s, x, y in zip(sprites, xs, ys):
-            display.draw(s, x, y, Color.scale(1 - t / steps, color))
-            display.show()
-        time.sleep(T.AnimationUpdate)
-
-
-def notify_text(display, text):
-    debug('notify_text', text)
-    n = len(text)
-    l = [S.letter(i) for i in text]
-    x = [4 - 2 * n + 4 * i for i in range(n)]
-    y = [1] * n
-    notify_sprite(display, l, x, y, Color.Yellow)
 
+async def notify_sprite(display, sprites, xs, ys, color):
+    await fly_by(display)
 
-def standby(display, next_pass):
     display.clear()
-    display.show()
-
-    t0 = next_pass.StartTime
-    reminders = [(t0 - timedelta(hours=24), '1D'),
-                 (t0 - timedelta(hours=12), '12H'),
-                 (t0 - timedelta(hours=6), '6H'),
-                 (t0 - timedelta(hours=3), '3H'),
-                 (t0 - timedelta(hours=2), '2H'),
-                 (t0 - timedelta(hours=1), '1H'),
-                 (t0 - timedelta(minutes=45), '45'),
-                 (t0 - timedelta(minutes=30), '30'),
-                 (t0 - timedelta(minutes=15), '15'),
-                 (t0 - timedelta(minutes=10), '10'),
-                 (t0 - timedelta(minutes=5), '5'),
-                 (t0 - timedelta(minutes=2), '2'),]
-    
-    t0 = next_pass.StartTime - T.CountdownDuration - T.SetupDuration
-    while True:
-        t = datetime.utcnow()
-        if t >= t0: return
+    steps = int(T.NotifyFadeDuration.total_seconds() / T.AnimationUpdate)
+    async for t in Frames(T.AnimationUpdate, steps):
+        with display.tick():
+            for s, x, y in zip(sprites, xs, ys):
+                display.draw(s, x, y, Color.scale(t / steps, color))
+                display.show()
+    await asyncio.sleep(T.NotifyTextDuration.total_seconds())
+    async for t in Frames(T.AnimationUpdate, steps):
+        with display.tick():
+            for s, x, y in zip(sprites, xs, ys):
+                display.draw(s, x, y, Color.scale(1 - t / steps, color))
+                display.show()
+
+
+async def notify_text(display, text):
+    debug('notify_text', text)
+    strip = S.text(text)
+    width = strip.shape[1] - 1
+    if width > 8:
+        await fly_by(display)
+        await marquee(display, text, Color.Yellow)
+    else:
+        await notify_sprite(display, [Bitboard.from_mask(strip)],
+                            [4 - (width + 1) // 2], [1], Color.Yellow)
 
-        reminder = None
-        while len(reminders) > 0 and t >= reminders[0][0]:
-            reminder = reminders.pop(0)
 
-        if reminder and (t - reminder[0]).total_seconds() < 15:
-            notify_text(display, reminder[1])
+async def marquee(display, text, color, y=1):
+    # Scrolls the rendered text across the panel, one column per frame
+    strip = S.text(text)
+    frames = Frames(T.MarqueeStep, 8 + strip.shape[1])
+    async for n in frames:
+        display.clear()
+        display.draw(strip, 8 - n, y, color)
+        display.show()
+    debug('marquee:', frames)
 
-        blink(display, Color.green(0.5))
-        time.sleep(T.StatusUpdate)
-        
 
-def countdown(display, next_pass):
+async def countdown(display, timeline):
     display.clear()
     display.show()
 
-    t0 = next_pass.StartTime
-    t1 = next_pass.StartTime - T.CountdownDuration - T.SetupDuration
-    tend = next_pass.StartTime - T.SetupDuration
-
-    spin_until(t1)
-    
-    while True:
-        t = datetime.utcnow()
-        if t >= tend: return
-
-        dt = (t0 - t).total_seconds()
+    t0 = Frames.monotonic(timeline.start)
+    frames = Frames(T.AnimationUpdate, until=Frames.monotonic(timeline.setup))
+    async for n in frames:
+        dt = t0 - frames.time(n)
         dmin = int(dt / 60)
         dsec = int(dt % 60)
 
@@ -591,80 +2584,57 @@ def countdown(display, next_pass):
             display.draw(S.digit(dsec // 10), 1, 1, Color.Yellow)
             display.draw(S.digit(dsec % 10), 4, 1, Color.Yellow)
         display.show()
-        time.sleep(T.AnimationUpdate)
+    debug('countdown:', frames)
 
 
-def setup(display, next_pass):
+async def setup(display, timeline):
     display.clear()
     display.show()
 
-    t0 = next_pass.StartTime
-    while datetime.utcnow() < t0:
-        display.clear()
-        display.edge(Azimuth.from_string('N'), Color.Blue)
-        display.show()
-        time.sleep(0.2)
+    frames = Frames(0.2, until=Frames.monotonic(timeline.start))
+    async for n in frames:
         display.clear()
         display.edge(Azimuth.from_string('N'), Color.Blue)
-        display.edge(next_pass.StartAzimuth, Color.red(0.5))
+        if n % 2 == 1:
+            display.edge(timeline.next_pass.StartAzimuth, Color.red(0.5))
         display.show()
-        time.sleep(0.2)
 
 
-def monitor(display, next_pass):
+async def monitor(display, timeline):
     display.clear()
     display.show()
 
-    t0 = next_pass.StartTime
-    t1 = next_pass.HighTime
-    t2 = next_pass.EndTime
-
-    spin_until(t0)
-
-    da1 = next_pass.HighAzimuth - next_pass.StartAzimuth
-    if da1 > 180:
-        da1 = da1 - 360
-    da2 = next_pass.EndAzimuth - next_pass.HighAzimuth
-    if da2 > 180:
-        da2 = da2 - 360
-
-    while True:
-        t = datetime.utcnow()
-        if t >= t2: return
-
-        if t < t1:
-            x = (t - t0).total_seconds() / (t1 - t0).total_seconds()
-            az = next_pass.StartAzimuth + x * da1
-            if az < 0:
-                az = az + 360
-        else:
-            x = (t2 - t).total_seconds() / (t2 - t1).total_seconds()
-            az = next_pass.EndAzimuth - x * da2
-            if az < 0:
-                az = az + 360
+    track = timeline.track
+    t0 = Frames.monotonic(timeline.start)
+    frames = Frames(T.AnimationUpdate, until=Frames.monotonic(timeline.end))
+    async for n in frames:
+        i = track.index(frames.time(n) - t0)
 
         display.clear()
-        display.spot(Tween.distinv(x), Color.White)
+        display.fill(track.path, Color.white(0.1))
+        display.fill(track.trail[i], Color.yellow(0.3))
         display.edge(Azimuth.from_string('N'), Color.Blue)
-        display.edge(az, Color.Red)
+        display.fill(track.position[i], Color.White)
         display.show()
-        time.sleep(T.AnimationUpdate)
+    await sleep_until(timeline.end)
+    debug('monitor:', frames)
 
 
-def splash_screen(display):
+async def splash_screen(display):
     steps = int(T.SplashDuration.total_seconds() / T.AnimationUpdate)
-    for i in range(steps):
+    frames = Frames(T.AnimationUpdate, steps)
+    async for i in frames:
         x = Tween.ease(Tween.back_and_forth(i / steps))
         display.clear()
         display.draw(S.iss_panels, 0, 0, Color.yellow(x))
         display.draw(S.iss_body, 0, 0, Color.white(x))
         display.show()
-        time.sleep(T.AnimationUpdate)
+    debug('splash_screen:', frames)
 
 
-def question(display, next_pass):
+async def question(display, next_pass, tz=timezone.utc):
     if next_pass is None:
-        notify_sprite(display, [S.no_pass], [0], [0], Color.White)
+        await notify_sprite(display, [S.no_pass], [0], [0], Color.White)
     else:
         dt = next_pass.StartTime - datetime.utcnow()
         days = dt.days
@@ -679,53 +2649,318 @@ def question(display, next_pass):
             text = str(minutes)
         else:
             text = ''
-        notify_text(display, text)
+        start = next_pass.StartTime.replace(tzinfo=timezone.utc).astimezone(tz)
+        await notify_text(display, (text + ' ' + start.strftime('%H:%M')).strip())
 
 
 class IssPy:
-    def __init__(self):
+    Preferences = ['filters', 'tz', 'reminders', 'refresh']
+    MaxReminder = 14 * 24 * 60
+    MaxRefresh = 7 * 24 * 60
+
+    def __init__(self, refresh_period=T.PrefetchPeriod, passfilter=None,
+                 backend=None, http=None):
         self.locked = True
-        self.display = Display()
-        self.display.sense_hat.stick.direction_any = self.joystick
+        self.phase = 'splash'
+        if backend is None:
+            backend = SenseHatBackend()
+        self.compositor = Compositor(backend)
+        self.display = self.compositor.layer(Compositor.Base)
+        self.status = self.compositor.layer(Compositor.Status)
         self.next_pass = None
-        self.tavail = time.time()
-        splash_screen(self.display)
-        self.locked = False
+        self.prefetcher = Prefetcher(refresh_period, passfilter)
+        self.tz = passfilter.tz if passfilter is not None else timezone.utc
+        self.events = asyncio.Queue()
+        self.asking = None
+        self.loop = None
+        self.timeline = None
+        self.runner = None
+        self.running = None
+        self.shown = asyncio.Event()
+        self.reminders = Timeline.Reminders
+        self.http = StatusServer(self, http) if http is not None else None
 
     def __del__(self):
-        if self.display is not None:
-            self.display.sense_hat.stick.direction_any = None
-            self.display.sense_hat.clear()
-
-    def step(self):
+        if self.compositor is not None:
+            if self.compositor.backend.stick is not None:
+                self.compositor.backend.stick.direction_any = None
+            self.compositor.backend.clear()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.compositor.on_first_frame = self.splash_shown
+        render = self.loop.create_task(self.compositor.run())
+        if self.compositor.backend.stick is not None:
+            self.compositor.backend.stick.direction_any = self.joystick
+        splash = self.loop.create_task(splash_screen(self.display))
+        self.prefetcher.start()
+        profile = self.loop.create_task(self.profile_startup())
+        server = None
+        if self.http is not None:
+            server = await self.http.start()
+        await splash
+        self.locked = False
+        inputs = self.loop.create_task(self.handle_events())
+        try:
+            while True:
+                await self.step()
+        finally:
+            if server is not None:
+                server.close()
+            profile.cancel()
+            inputs.cancel()
+            self.prefetcher.stop()
+            render.cancel()
+
+    def splash_shown(self):
+        # Only checked: the imports before main, numpy first, are most of
+        # the time to the splash screen
+        Startup.mark('splash')
+        self.shown.set()
+        if Startup.elapsed() > T.SplashBudget:
+            info('Splash screen after {:.1f}s, over the {}s budget'.format(
+                Startup.elapsed(), T.SplashBudget))
+
+    async def profile_startup(self):
+        if self.prefetcher.fetches == 0:
+            await self.prefetcher.wait()
+        Startup.mark('passes')
+        await self.shown.wait()
+        Startup.report()
+
+    async def step(self):
         if self.next_pass is None:
-            self.next_pass = search(self.display)
+            self.phase = 'search'
+            self.next_pass = await search(self.display, self.status,
+                                          self.prefetcher)
             info("Next pass:", self.next_pass)
 
         if self.next_pass is not None:
-            standby(self.display, self.next_pass)
-
+            self.phase = 'standby'
+            self.timeline = Timeline(self.next_pass, self.reminders)
+            debug('Timeline:\n' + str(self.timeline))
+
+            self.display.clear()
+            self.display.show()
+            t = datetime.utcnow()
+            self.runner = Runner(self.handle_timeline)
+            if t < self.timeline.countdown:
+                self.runner.at(t, 'status')
+            for event in self.timeline.pending(t):
+                self.runner.at(*event)
+            self.running = self.loop.create_task(self.runner.run())
+            try:
+                await asyncio.wait([self.running])
+            finally:
+                self.running.cancel()
+
+            if self.running.cancelled():
+                # Stopped by reschedule, the next pass is searched again
+                self.status.clear()
+                self.status.show()
+            else:
+                # Errors of the phases are raised again, as when the runner
+                # was awaited directly
+                self.running.result()
+                self.prefetcher.refresh()
+            self.next_pass = None
+            debug('Display frames: {} sent, {} skipped'.format(
+                self.compositor.frames_sent, self.compositor.frames_skipped))
+
+    async def handle_timeline(self, t, kind, data):
+        if kind == 'status':
+            # Standby blink, until the countdown
+            await blink(self.status, Color.green(0.5))
+            t = max(t + timedelta(seconds=T.StandbyUpdate), datetime.utcnow())
+            if t < self.timeline.countdown:
+                self.runner.at(t, 'status')
+        elif kind == 'reminder':
+            await notify_text(self.display, data)
+        elif kind == 'countdown':
             self.locked = True
-            countdown(self.display, self.next_pass)
-            setup(self.display, self.next_pass)
-            monitor(self.display, self.next_pass)
+            self.phase = kind
+            if self.asking is not None:
+                self.asking.cancel()
+            await countdown(self.display, self.timeline)
+        elif kind == 'setup':
+            self.phase = kind
+            await setup(self.display, self.timeline)
+        elif kind == 'monitor':
+            self.phase = kind
+            await monitor(self.display, self.timeline)
+        elif kind == 'end':
             self.locked = False
 
-            self.next_pass = None
-
     def joystick(self, event):
-        if not self.locked:
-            if event.action == 'pressed' and event.timestamp > self.tavail:
-                question(self.display, self.next_pass)
-                self.tavail = time.time()
+        # Called on the joystick thread
+        self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+    async def handle_events(self):
+        # Presses queued while busy are handled as one, and presses closer
+        # than T.Debounce to the last one handled are ignored
+        last = 0
+        while True:
+            events = [await self.events.get()]
+            while not self.events.empty():
+                events.append(self.events.get_nowait())
+            pressed = [e.timestamp for e in events
+                       if e.action == 'pressed' and e.timestamp - last >= T.Debounce]
+            if self.locked or len(pressed) == 0:
+                continue
+            last = pressed[-1]
+            if self.asking is None or self.asking.done():
+                self.asking = self.loop.create_task(self.ask())
+
+    async def ask(self):
+        with self.compositor.overlay(Compositor.Overlay, opaque=True,
+                                     lifetime=T.OverlayLifetime) as display:
+            await question(display, self.next_pass, self.tz)
+
+    def reschedule(self):
+        # Plans the next pass again, unless it is already being shown
+        if not self.locked and self.running is not None and not self.running.done():
+            self.running.cancel()
+
+    def status_report(self):
+        p = self.prefetcher
+        return {'phase': self.phase,
+                'next_pass': self.next_pass.to_dict() if self.next_pass is not None else None,
+                'provider': {'name': API.name(),
+                             'busy': p.busy,
+                             'fetches': p.fetches,
+                             'failures': p.failures,
+                             'updated': p.updated.isoformat() if p.updated is not None else None,
+                             'error': p.error},
+                'display': {'frames_sent': self.compositor.frames_sent,
+                            'frames_skipped': self.compositor.frames_skipped}}
+
+    def preferences(self):
+        passfilter = self.prefetcher.passfilter
+        return {'filters': list(passfilter.text) if passfilter is not None else [],
+                'tz': str(self.tz),
+                'reminders': [int(dt.total_seconds() // 60) for dt, _ in self.reminders],
+                'refresh': self.prefetcher.period.total_seconds() / 60}
+
+    def set_preferences(self, changes):
+        # Everything is checked before anything changes, and there is no
+        # await in between: the other tasks see all of the changes or none
+        unknown = sorted(set(changes) - set(IssPy.Preferences))
+        if len(unknown) > 0:
+            raise ValueError('Unknown preferences: ' + ', '.join(unknown))
+        preferences = self.preferences()
+        preferences.update(changes)
+        filters = preferences['filters']
+        if not isinstance(filters, list) or not all(isinstance(f, str) for f in filters):
+            raise ValueError('filters must be a list of strings')
+        try:
+            ZoneInfo(preferences['tz'])
+        except (TypeError, ValueError, ZoneInfoNotFoundError):
+            raise ValueError('Unknown time zone "{}"'.format(preferences['tz']))
+        passfilter = PassFilter(filters, preferences['tz'])
+        reminders = IssPy.make_reminders(preferences['reminders'])
+        refresh = preferences['refresh']
+        if (not isinstance(refresh, (int, float)) or isinstance(refresh, bool) or
+                not 0 < refresh <= IssPy.MaxRefresh):
+            raise ValueError('refresh must be a number of minutes, '
+                             'up to {}'.format(IssPy.MaxRefresh))
+        period = timedelta(minutes=refresh)
+
+        self.prefetcher.set_filter(passfilter)
+        self.tz = passfilter.tz
+        self.reminders = reminders
+        if period != self.prefetcher.period:
+            self.prefetcher.period = period
+            self.prefetcher.refresh()
+        info('Filtering passes on', passfilter)
+        self.reschedule()
+        return self.preferences()
+
+    @staticmethod
+    def make_reminders(minutes):
+        # [1440, 180, 45] -> reminders shown as 1D, 3H and 45. Minutes are
+        # whole numbers, the font has no '.'
+        if not isinstance(minutes, list) or not all(
+                isinstance(m, (int, float)) and not isinstance(m, bool) and
+                float(m).is_integer() and 0 < m <= IssPy.MaxReminder
+                for m in minutes):
+            raise ValueError('reminders must be a list of whole minutes, '
+                             'from 1 to {}'.format(IssPy.MaxReminder))
+        reminders = []
+        for m in sorted(set(int(m) for m in minutes), reverse=True):
+            if m % 1440 == 0:
+                text = '{}D'.format(m // 1440)
+            elif m % 60 == 0:
+                text = '{}H'.format(m // 60)
+            else:
+                text = str(m)
+            reminders.append((timedelta(minutes=m), text))
+        return tuple(reminders)
+
+
+def make_provider(args, tles, location, satids):
+    if args.server:
+        return PassServerProvider(args.server, location, satids)
+    providers = []
+    if args.tle:
+        for tle in tles:
+            if int(tle[0][2:7]) in satids:
+                providers.append(LocalPredictor(location, tle))
+    else:
+        for satid in satids:
+            provider = HeavensAbove(location, satid)
+            if not args.no_cache:
+                provider = CachedProvider(provider, args.cache,
+                                          timedelta(hours=args.cache_ttl))
+            providers.append(provider)
+    if len(providers) == 0:
+        return NoneProvider()
+    elif len(providers) == 1:
+        return providers[0]
+    else:
+        return MultiProvider(providers, T.FetchWorkers)
 
 
 def main(arguments):
     import argparse
-    import json
     parser = argparse.ArgumentParser('IssPy - ISS monitoring system')
     parser.add_argument('-f', type=open, dest='file')
+    parser.add_argument('--cache', dest='cache',
+                        default=os.path.expanduser('~/.iss-py/cache.json'),
+                        help='pass cache file')
+    parser.add_argument('--cache-ttl', type=float, dest='cache_ttl',
+                        default=T.CacheTTL.total_seconds() / 3600,
+                        help='hours before cached passes are refreshed')
+    parser.add_argument('--no-cache', action='store_true', dest='no_cache')
+    parser.add_argument('--url', dest='url', default=HeavensAbove.Url,
+                        help='Heavens Above PassSummary page')
+    parser.add_argument('--tle', type=open, dest='tle',
+                        help='predict passes locally from this TLE file')
+    parser.add_argument('--display', dest='display', default='sensehat',
+                        choices=['sensehat', 'framebuffer', 'record'],
+                        help='display backend')
+    parser.add_argument('--record', dest='record',
+                        help='with --display record, save the frames to this '
+                             'frame log (or .png strip) on exit')
+    parser.add_argument('--fb', dest='fb',
+                        help='framebuffer device, found by name by default')
+    parser.add_argument('--refresh', type=float, dest='refresh',
+                        default=T.PrefetchPeriod.total_seconds() / 60,
+                        help='minutes between background pass refreshes')
+    parser.add_argument('--startup-profile', action='store_true',
+                        dest='startup_profile',
+                        help='log the time spent in each startup phase')
+    parser.add_argument('--serve', dest='serve',
+                        help='run as a pass server for other iss-py on this '
+                             'address (host:port or unix:/path)')
+    parser.add_argument('--server', dest='server',
+                        help='get passes from the pass server at this address')
+    parser.add_argument('--geohash', type=int, dest='geohash', default=5,
+                        help='with --serve, geohash precision of the shared cells')
+    parser.add_argument('--http', dest='http',
+                        help='serve the status, passes and preferences over '
+                             'HTTP on this address (host:port or unix:/path)')
     args = parser.parse_args(arguments[1:])
+    Startup.enabled = args.startup_profile
 
     settings = None
     if args.file:
@@ -740,20 +2975,57 @@ def main(arguments):
         location = settings
     info('Location set to "{}"'.format(location['name']))
 
+    HeavensAbove.Url = args.url
+    tles = []
+    if args.tle:
+        lines = [l for l in args.tle if l[:2] in ['1 ', '2 ']]
+        tles = list(zip(lines[0::2], lines[1::2]))
+    if args.serve:
+        server = PassServer(args.serve,
+                            lambda loc, satid: make_provider(args, tles, loc, [satid]),
+                            timedelta(minutes=args.refresh), args.geohash)
+        asyncio.run(server.run())
+        return
+
     S.init()
+    Startup.mark('settings')
 
+    # Stopped by timeout, systemd or CI like with Ctrl-C, so that the frames
+    # are still saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    backend = None
     try:
+        if args.display == 'framebuffer':
+            backend = FramebufferBackend(args.fb)
+        elif args.display == 'record':
+            backend = RecordingBackend()
+        else:
+            backend = SenseHatBackend()
+        info('Display set to "{}"'.format(backend.name()))
+        Startup.mark('display')
+
 ##        provider = TestProvider()
 ##        API.set_provider(NoneProvider())
 ##        API.set_provider(TestProvider())
-        API.set_provider(HeavensAbove(location))
-        isspy = IssPy()
-        while True:
-            data = isspy.step()
+        satids = location.get('satids', [25544])
+        API.set_provider(make_provider(args, tles, location, satids))
+        passfilter = PassFilter(location.get('filters', []),
+                                location.get('tz', 'UTC'))
+        info('Filtering passes on', passfilter)
+        Startup.mark('providers')
+        isspy = IssPy(timedelta(minutes=args.refresh), passfilter, backend,
+                      args.http)
+        asyncio.run(isspy.run())
     except:
-        SenseHat().clear()
+        if backend is not None:
+            backend.clear()
         raise
+    finally:
+        if args.record and isinstance(backend, RecordingBackend):
+            backend.dump(args.record)
+
 
+Startup.mark('module')
 
 if __name__ == '__main__':
     import sys